@@ -0,0 +1,166 @@
+"""This script implements Knuth's Algorithm X for the exact cover problem, with the
+matrix held as bit sets in Python integers instead of dancing links."""
+
+# Each column is represented by the set of its rows, and each row by the set of
+# its columns, as integers in which bit k stands for row (or column) k.  The state
+# of the search is just two integers: the rows that can still be chosen and the
+# primary columns still to be covered.  Choosing a row r removes, in one ANDNOT,
+# every row that shares a column with r.  That set depends only on r, so it is
+# computed once, when the matrix is read.  The AND, ANDNOT and bit counts all run
+# in C, which for the small matrices of kenken is much cheaper than following
+# links in Python.
+
+# The input is the same as for dance4.Dancer, and so is the interface: construct,
+# then solve() and report().  Columns are chosen exactly as Dancer chooses them,
+# the first shortest column in the order given, so both engines search the same
+# tree.  The iterated dancing links pre-pass is not needed here, since long
+# columns cost nothing to update; bound and pattern are accepted and ignored.
+
+from dance4 import ColumnError
+
+class BitDancer(object):
+
+    def __init__(self, primary, matrix, secondary = [], bound = 42000, pattern = None):
+        if primary == []:
+            raise RuntimeError("No primary columns!")
+        if matrix == []:
+            raise RuntimeError("No membership matrix")
+        self.columns = primary + secondary
+        index = self.index = {}         # column name -> bit number
+        for bit, col in enumerate(self.columns):
+            index[col] = bit
+        for row in matrix:
+            for col in row[:-1]:
+                if not col in index:
+                    raise ColumnError(col)
+        self.primaryMask = (1 << len(primary)) - 1
+        self.updates = 0
+        self.solutions = []
+
+        self.readRows(matrix)
+
+    def readRows(self, matrix):
+        """Initialize the membership matrix.
+
+        The input is the same as for Dancer.readRows: each row lists the names of the
+        columns with a 1 in this row, followed by a symbolic name for the row."""
+
+        index = self.index
+        self.rows = rows = []           # symbolic row names, by row number
+        self.rowCols = rowCols = []     # the columns of each row
+        self.colRows = colRows = [0] * len(self.columns)  # the rows of each column
+
+        for rowNum, row in enumerate(matrix):
+            rows.append(row[-1])
+            bit = 1 << rowNum
+            cols = 0
+            for col in row[:-1]:
+                c = index[col]
+                cols |= 1 << c
+                colRows[c] |= bit
+            rowCols.append(cols)
+
+        # the rows that cannot be in the same solution as each row, including itself
+
+        self.conflicts = conflicts = []
+        for row in matrix:
+            blocked = 0
+            for col in row[:-1]:
+                blocked |= colRows[index[col]]
+            conflicts.append(blocked)
+
+        self.activeRows = (1 << len(rows)) - 1
+
+    def _dance(self, findAll):
+        # The main routine, a generator which yields the list of row numbers of each
+        # solution as it is found.  The list is only valid until the generator is resumed.
+
+        rowCols   = self.rowCols
+        colRows   = self.colRows
+        conflicts = self.conflicts
+        choice    = []              # the rows in the current partial solution
+        stack     = []              # for each level: [rows, cols, untried candidates]
+        rows      = self.activeRows
+        cols      = self.primaryMask
+
+        while True:
+
+            # forward: push the rows of the best column for branching
+
+            if not cols:
+                yield choice
+                if not findAll:
+                    return
+            else:
+                minLength = 10000000  # infinity
+                cc = cols
+                while cc:
+                    low = cc & -cc
+                    cc ^= low
+                    cand = colRows[low.bit_length() - 1] & rows
+                    length = bin(cand).count('1')
+                    if length < minLength:
+                        candidates = cand
+                        minLength  = length
+                        if length == 0:
+                            break           # a dead end: can't do better
+                stack.append([rows, cols, candidates])
+                choice.append(None)
+
+            # advance: choose the next untried row, backing up as needed
+
+            while stack:
+                top = stack[-1]
+                candidates = top[2]
+                if candidates:
+                    low = candidates & -candidates
+                    top[2] = candidates ^ low
+                    r = low.bit_length() - 1
+                    blocked = top[0] & conflicts[r]
+                    self.updates += bin(blocked).count('1')
+                    rows = top[0] ^ blocked
+                    cols = top[1] & ~rowCols[r]
+                    choice[-1] = r
+                    break
+                stack.pop()
+                choice.pop()
+            else:
+                return                      # done
+
+    def iter_solutions(self, limit = None):
+        """Generate the solutions one at a time, each as a list of row names, as soon
+        as the search finds them.  The search stops after limit solutions if a limit
+        is given."""
+
+        rows = self.rows
+        for num, choice in enumerate(self._dance(True)):
+            yield [rows[r] for r in choice]
+            if limit is not None and num + 1 >= limit:
+                break
+
+    def count(self, limit = None):
+        """Return the number of solutions, without recording them.  If a limit is given,
+        the search stops as soon as that many have been found."""
+
+        num = 0
+        for choice in self._dance(True):
+            num += 1
+            if num == limit:
+                break
+        return num
+
+    def is_unique(self):
+        """Does the problem have exactly one solution?  The search stops at the second."""
+
+        return self.count(limit = 2) == 1
+
+    def solve(self, findAll = True):
+        for choice in self._dance(findAll):
+            self.solutions.append(list(choice))
+        return self.updates
+
+    def report(self):
+
+        # Print report.  Intended to be called by class user.
+
+        return [[self.rows[r] for r in s] for s in self.solutions]
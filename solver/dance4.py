@@ -13,7 +13,10 @@ the exact cover problem by backtrack"""
 # one may ask for all such families, as Knuth does.
 
 # Kunth also considers an extension where some of the columns are
-# allowed to contain at most one 1.
+# allowed to contain at most one 1.  In a further extension, XCC, the 1s in
+# these secondary columns may have colors.  Rows whose 1s in a secondary
+# column have the same color do not conflict there: a column may be used by
+# any number of rows in a solution, so long as they all give it one color.
 
 # This script contains a variation of the DLX algorithm that might be
 # called "iterated dancing links" or IDLX.  A problem with DLX is that
@@ -33,17 +36,143 @@ the exact cover problem by backtrack"""
 # import psyco
 #from psyco.classes import *
 
+import multiprocessing, threading
+import cPickle, os, time, random, math
+from collections import namedtuple, OrderedDict
+import strategies
+
+# The result of Dancer.estimate.  Each error is the half-width of a 95% confidence
+# interval for the estimate before it.
+
+Estimate = namedtuple('Estimate', 'nodes nodesError updates updatesError solutions')
+
+# The outcome of the last Dancer.solve or Dancer.count.  If the search was not complete,
+# reason says which limit stopped it, and the counts are those when it stopped.
+
+Result = namedtuple('Result', 'complete reason found nodes updates')
+
+# What one pass of the iterated dancing links pre-pass did: in round number round, the
+# columns of group number group longer than the bound were excluded, and rows rows
+# were deleted, removing nodes nodes from the matrix, at a cost of updates updates.
+
+Round = namedtuple('Round', 'round group columns rows nodes updates')
+
+# The plan chosen for the pre-pass when the bound is 'auto': whether to do it, the bound
+# chosen, the columns it would exclude, the nodes in the rows of those columns, and the
+# nodes in the matrix.
+
+Plan = namedtuple('Plan', 'prefilter bound columns excluded nodes')
+
+# What Dancer.preprocess removed from the matrix, in passes passes: the rows deleted
+# because they conflict with a forced row, because they conflict with every row of some
+# column, because they duplicate another row (only when one solution is wanted), and
+# because they lie in a dominating column, and in all, rows rows and nodes nodes.  forced is the number of rows found
+# to be alone in a primary column; they are kept, and chosen first by the search.
+
+Reduction = namedtuple('Reduction', 'passes forced conflicts blocking duplicates dominated rows nodes')
+
+# A primary column whose rows are made only when the search branches on it.  rows is a
+# function of the Dancer that returns the rows, in the form readRows takes, that are
+# still possible; it may use Dancer.covered to leave out the others.  Each row must
+# have the column itself, and no colors.  support is the set of the other columns its
+# rows may have, and estimate is the length the column is taken to have when the
+# column for branching is chosen.
+
+Lazy = namedtuple('Lazy', 'rows support estimate')
+
+class CancelToken(object):
+    # Lets another thread stop a search.  Pass one to Dancer.solve or Dancer.count,
+    # and call set() to stop the search at its next check.
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def set(self):
+        self.event.set()
+
+    def isSet(self):
+        return self.event.isSet()
+
+class SearchStopped(Exception):
+    # Raised inside the search when a limit is reached
+    pass
+
+def _column(entry):
+    # The column of an entry of a row: the entry itself, or the column of a colored
+    # entry (column, color)
+
+    if type(entry) is tuple:
+        return entry[0]
+    return entry
+
 class ColumnError(Exception):
     def __init__(self, value):
         self.value = value
     def __str__(self):
         return repr(self.value)
 
+class ZDD(object):
+    # A zero-suppressed decision diagram of a family of solutions, as built by
+    # Dancer.zdd.  Node 0 stands for no solutions and node 1 for the one empty
+    # solution.  Any other node n stands for the solutions that contain row[n] and
+    # one of the solutions of hi[n], together with the solutions of lo[n], none of
+    # which contain row[n].  The number of solutions of each node is found as it is
+    # made, so counting and sampling take no search.
+
+    BOTTOM = 0
+    TOP    = 1
+
+    def __init__(self):
+        self.row    = [None, None]
+        self.lo     = [0, 0]
+        self.hi     = [0, 0]
+        self.counts = [0, 1]        # number of solutions of each node
+        self.unique = {}            # (row, lo, hi) -> node, so no node is made twice
+        self.root   = 0
+
+    def __len__(self):
+        return len(self.row)
+
+    def node(self, row, lo, hi):
+        # The node for row, lo and hi
+        if hi == ZDD.BOTTOM:
+            return lo
+        key = (row, lo, hi)
+        n = self.unique.get(key)
+        if n is None:
+            n = self.unique[key] = len(self.row)
+            self.row.append(row)
+            self.lo.append(lo)
+            self.hi.append(hi)
+            self.counts.append(self.counts[lo] + self.counts[hi])
+        return n
+
+    def count(self):
+        return self.counts[self.root]
+
+    def sample(self, rand):
+        """A solution chosen uniformly at random, as a list of rows, using the
+        random.Random rand.  Returns None if there are no solutions."""
+
+        n = self.root
+        if self.counts[n] == 0:
+            return None
+        counts = self.counts
+        solution = []
+        while n != ZDD.TOP:
+            hi = self.hi[n]
+            if rand.randrange(counts[n]) < counts[hi]:
+                solution.append(self.row[n])
+                n = hi
+            else:
+                n = self.lo[n]
+        return solution
+
 #class Node(psyco.compact):
 class Node(object):
     # A nonzero entry in the membership matrix
 
-    def __init__(self,left=None,right=None,up=None,down=None,col=None,row=None):
+    def __init__(self,left=None,right=None,up=None,down=None,col=None,row=None,color=0):
                             # all lists are circular in both directions
         self.left  = left   # the column name of the previous 1 in this row
         self.right = right  # the column name of the next 1 in this row
@@ -51,6 +180,7 @@ class Node(object):
         self.down  = down   # the row number of the next 1 in this column
         self.col   = col    # the name of this column
         self.row   = row    # the number of this row  (or possibly 'head')
+        self.color = color  # 0, or the number of its color; -1 while purified
 
 #class Column(psyco.compact):
 class Column(object):
@@ -61,6 +191,11 @@ class Column(object):
         self.next   = next
         self.length = 0         # number of 1's in this column
         self.seconded = False   # temporarily made secondary?
+        self.primary = False    # a primary column?
+        self.queued = False     # in the bucket of its length?
+        self.bit = 0            # its bit in the buckets: 1 << its position, if primary
+        self.lazy = None        # the Lazy, if its rows are made during the search
+        self.pending = 0        # lazy columns not yet expanded that may add rows to it
 
 #class Dancer(psyco.compact):
 class Dancer(object):
@@ -72,28 +207,138 @@ class Dancer(object):
     # If pattern (a compiled regular expression is supplied, then the iterated dancing
     # links alogorithm will be employed.  Any columns whose name matches the
     # pattern and whose length exceeds the bound will be initially excluded from the
-    # problem.
-
-    def __init__(self, primary, matrix, secondary = [], bound = 42000, pattern = None):
+    # problem.  pattern may also be a list of patterns, one for each group of long
+    # columns; see _prefilter.  If bound is 'auto', the bound is chosen when the
+    # pre-pass is about to run; see _planPrefilter.
+
+    # If buckets is True, the columns are kept in a bucket queue by length, so that the
+    # column for branching is found without scanning the header list.  See makeBuckets.
+    # On kenken-sized matrices this is slower than the scan, not faster: 28Mar8 takes
+    # 1.26s with buckets against 0.97s without, since every update pays to keep the
+    # buckets and the scan is short.  It only pays when there are many more primary
+    # columns than updates per node, so it is off by default.
+
+    # strategy chooses the column for branching, instead of the first shortest column.
+    # It is a strategies.Strategy, or the name of one in strategies.byName.
+
+    # If preprocess is True, the matrix is reduced by preprocess() before the search.
+    # Duplicate rows are only deleted by solve(findAll = False), since the other
+    # solutions they make would be lost to the searches for all of them.
+
+    # lazy is a dict of Lazy, by column, for primary columns whose rows are made during
+    # the search.  See _expand.
+
+    # An entry of a row may be a pair (column, color) instead of a column, for a 1 of
+    # that color in a secondary column.  Choosing the row then purifies the column,
+    # instead of covering it: the rows with another color there are blocked, and the
+    # rows with the same color stay, as they agree with it.  This is Knuth's algorithm
+    # C.  A secondary column may have both colored and plain 1s; a plain one conflicts
+    # with all the others.  Only Dancer supports colors.
+
+    planColumns = 4         # the most columns the plan will exclude
+    planShare   = 0.6       # the part of the nodes they must hold for a pre-pass
+    clockUpdates = 10000    # updates between looks at the clock, for a deadline
+
+    def __init__(self, primary, matrix, secondary = [], bound = 42000, pattern = None,
+                 buckets = False, strategy = None, preprocess = False, lazy = None):
         if primary == []:
-            raise RunTimeError("No primary columns!")
+            raise RuntimeError("No primary columns!")
         if matrix == []:
-            raise RunTimeError("No membership matrix")
+            raise RuntimeError("No membership matrix")
         self.columns = primary + secondary
-        for row in matrix:
-            for col in row[:-1]:
-                if not col in self.columns:
-                    raise ColumnError(col)
+        self.columnSet = set(self.columns)
+        self.primary   = primary
+        self.secondary = secondary
         self.nodes   = {}
         self.headers = {}
-        self.rows = {}
-        self.updates = 0
-        self.solutions = []
-        self.bound = bound
+        self.boundSetting = bound   # the bound given, since 'auto' is replaced by a number
         self.pattern = pattern
+        self.useBuckets = buckets
+        self.usePreprocess = preprocess
+        self.lazy = lazy or {}
+        self.checkpointFile = None
+        if isinstance(strategy, str):
+            strategy = strategies.byName[strategy]()
+        self.strategy = strategy
 
         self.setHeaders(primary, secondary)
+        self.reset(matrix)
+
+    def reset(self, matrix):
+        """Load the rows of matrix, in place of the rows there were, and forget the
+        solutions and the counts, so that another problem with the same columns can be
+        solved without building a new Dancer.  The column headers are kept, and only
+        their links and lengths are set back to what they were at the start."""
+
+        columnSet = self.columnSet
+        secondary = set(self.secondary)
+        self.colored = False        # are there colored entries?
+        for row in matrix:
+            for col in row[:-1]:
+                if not col in columnSet:
+                    if type(col) is tuple and col[0] in secondary:
+                        self.colored = True
+                    else:
+                        raise ColumnError(col)
+        self.matrix  = matrix       # kept to rebuild the problem in worker processes
+        self.colorCode = {}         # the number of each color, from 1 up
+        self.rows = {}
+        self.firstCol = {}          # the first column in each row
+        self.deleted = set()        # rows removed by deleteRow
+        self.updates = 0
+        self.nodeCount = 0          # number of nodes of the search tree visited
+        self.found = 0              # number of solutions found
+        self.solutions = []
+        self.bound = self.boundSetting
+        self.prefiltered = False
+        self.rounds = []            # a Round for each pass of the pre-pass
+        self.plan = None            # the Plan, if the bound is 'auto'
+        self.reduction = None       # the Reduction, once preprocess() is done
+        self.diagram = None         # the ZDD of the solutions, once zdd() is called
+        self.buckets = None
+        self.setLimits()
+        self.result = None          # a Result, after solve() or count()
+        self.mode = 'solve'         # what the search is for: 'solve', 'count' or 'iter'
+        self.limit = None           # the limit passed to count()
+        self.nextRow = len(matrix)  # the number for the next row made by _expand
+        self.lazyRows = {}          # lazy column -> {row name: row number}
+        self.expanded = []          # the rows made by each _expand not yet undone
+
+        self._clearColumns()
         self.readRows(matrix)
+        self.spare = []
+        if self.useBuckets and not self.lazy:
+            self.makeBuckets()
+
+    def _clearColumns(self):
+        # Empty the columns, and link the primary column headers in their original
+        # order.  The nodes of the old rows are kept in self.spare, for readRows to
+        # use again, which is faster than making new ones.
+
+        headers = self.headers
+        nodes   = self.nodes
+        heads   = {}
+        self.spare = [node for node in nodes.itervalues() if node.row != 'head']
+        prev = 'root'
+        for col in self.primary:
+            headers[prev].next = col
+            headers[col].prev  = prev
+            prev = col
+        headers[prev].next = 'root'
+        headers['root'].prev = prev
+        for col in self.columns:
+            h = headers[col]
+            h.length   = 0
+            h.seconded = False
+            h.queued   = False
+            h.pending  = 0
+            head = heads['head', col] = nodes['head', col]
+            head.up = head.down = 'head'
+        for col, lazy in self.lazy.items():
+            headers[col].lazy = lazy
+            for cc in lazy.support:
+                headers[cc].pending += 1
+        self.nodes = heads
 
     def _recorder(self, level, choice):
 
@@ -116,16 +361,20 @@ class Dancer(object):
         nodes = self.nodes
         headers['root'] = Column()
         curCol = 'root'
+        self.order = {}             # position of each primary column, for breaking ties
         for p in primary:
             headers[curCol].next = p
             headers[p] = Column(prev = curCol)
+            headers[p].primary = True
+            headers[p].bit = 1 << len(self.order)
+            self.order[p] = len(self.order)
             curCol = p
             nodes['head', p] = Node(up = 'head', down = 'head', col = curCol, row = 'head')
         headers[curCol].next = 'root'
         headers['root'].prev = curCol
         for s in secondary:
             headers[s] = Column(prev = s, next = s)
-            nodes['head', s] = Node(up = 'head', down = 'head', col = curCol, row = 'head')
+            nodes['head', s] = Node(up = 'head', down = 'head', col = s, row = 'head')
 
     def readRows(self, matrix):
         """Initialize the membership matrix.
@@ -133,21 +382,36 @@ class Dancer(object):
         The input is a list of rows.  The rows are simply the names of the columns with a
         1 in this row,  except that the last entry in each row is a symbolic name for the row.
         The columns must be listed in the same order as in the primary
-        and secondary inputs, primary columns first."""
+        and secondary inputs, primary columns first.  A 1 with a color in a secondary
+        column is given as the pair (column, color)."""
 
         nodes   = self.nodes
         rows    = self.rows
         headers = self.headers
+        spare   = self.spare
+        colorCode = self.colorCode
+        colored = self.colored
 
         for rowNum, row in enumerate(matrix):
             rows[rowNum] = row[-1]
+            if colored:
+                colors = [type(entry) is tuple and colorCode.setdefault(entry[1], len(colorCode) + 1)
+                          or 0 for entry in row[:-1]]
+                row = [_column(entry) for entry in row[:-1]] + [row[-1]]
+            self.firstCol[rowNum] = row[0]
             for i, c in enumerate(row[:-1]):
                 c = row[i]
                 h = nodes['head', c]
                 next = row[i+1]         # wrong for the last 1 in the row
+                color = colored and colors[i] or 0
 
                 # h.up points to last element in the column
-                nodes[rowNum, c] = Node(row[i-1],next, h.up, 'head', c, rowNum)
+                if spare:
+                    nn = nodes[rowNum, c] = spare.pop()
+                    nn.left, nn.right, nn.up, nn.down, nn.col, nn.row, nn.color = \
+                             row[i-1], next, h.up, 'head', c, rowNum, color
+                else:
+                    nodes[rowNum, c] = Node(row[i-1],next, h.up, 'head', c, rowNum, color)
 
                 # hook the new node in at the bottom of the column
                 # note that this will handle the first node in the column
@@ -161,13 +425,55 @@ class Dancer(object):
             nodes[rowNum, c].right = row[0]
             nodes[rowNum, row[0]].left = row[-2]
 
+    def makeBuckets(self):
+        """Set up the bucket queue used to choose the column for branching.  buckets[n]
+        holds the primary columns in the header list with length n, as an integer with
+        bit k set for the column in position k of the primary columns.  cover, uncover
+        and deleteRow move a column to its new bucket whenever its length changes, so
+        the shortest column is found in the first nonempty bucket, and the first of
+        them, which breaks the tie as the scan of the header list does, is its lowest
+        bit.  byBit[k] is the column in position k.
 
+        Keeping the buckets up to date costs two integer operations for every update.
+        On kenken matrices that is more than the scan saves, since the search makes
+        far more updates than choices, so this is optional."""
+
+        headers = self.headers
+        self.buckets = buckets = [0] * (1 + max([h.length for h in headers.values()]))
+        self.byBit = sorted(self.order, key = self.order.__getitem__)
+        cur = headers['root'].next
+        while cur != 'root':
+            h = headers[cur]
+            buckets[h.length] |= h.bit
+            h.queued = True
+            cur = h.next
 
-    def backTrack(self, findAll):
-        #The main routine.
+
+
+    def backTrack(self, findAll, stack = None):
+        # Record the solutions found by the main routine.
 
         # Returns the number of solutions found
 
+        count = 0
+        self.mode = 'solve'
+        for level, choice in self._dance(findAll, stack):
+            self._recorder(level, choice)
+            count += 1
+        return count
+
+    def _dance(self, findAll, stack = None):
+        #The main routine.
+
+        # A generator, which yields (level, choice) each time a solution is found, and
+        # resumes the search when the next solution is requested.  choice[0..level] are
+        # the nodes of the rows in the solution; they are only valid until the generator
+        # is resumed.  If the generator is closed early, or findAll is False, the
+        # columns covered by the partial solution are uncovered again before it stops.
+
+        # If stack is given, it is a list of (row, column) choices saved in a checkpoint,
+        # and the search resumes where it was then: just entering the subtree below them.
+
         # Knuth's comments in his dance program say, in part, "Our strategy for generating all
         # exact covers will be to repeatedly choose always the column that appears to be
         # hardest to cover, namely, the column with the shortest list, from all columns that
@@ -190,22 +496,51 @@ class Dancer(object):
         headers = self.headers
         root    = headers['root']
         rows    = self.rows
+        bestColumn = self._bestColumn
+        lazy    = self.lazy
+        self.checkpointing = self.checkpointFile is not None and self.mode != 'iter'
+        checking = self.checkpointing
+        if checking:
+            self._scheduleCheckpoint()
+        limited = self.limited
+        if limited:
+            try:
+                self._checkLimits()         # before the search starts
+            except SearchStopped, e:
+                self.stopped = e.args[0]
+                return
+
+        if root.next == 'root':
+            self.found += 1
+            yield -1, choice        # nothing to cover: the empty solution
+            return
+
+        if stack:
+            for row, col in stack:
+                choice[level] = nodes[row, col]
+                self._force(row, col)
+                level += 1
 
         while True:
 
             # forward:
 
             if state == 'forward':
-                # Set best to best column for branching (one with fewest elements)
-                minLength = 10000000  # infinity
-                cur       = root.next
+                if checking and self.nodeCount >= self.nextCheck:
+                    self._periodic(findAll, level, choice)
+                if limited:
+                    try:
+                        self._checkLimits()
+                    except SearchStopped, e:
+                        self.stopped = e.args[0]
+                        self._unwind(level - 1, choice)
+                        return
+                self.nodeCount += 1
 
-                while cur != 'root':
-                    h = headers[cur]
-                    if h.length < minLength:
-                        best      = cur
-                        minLength = h.length
-                    cur = h.next
+                # Set best to best column for branching (one with fewest elements)
+                best = bestColumn()
+                if lazy and headers[best].lazy:
+                    self._expand(best)
                 self.cover(best)
                 choice[level] = nodes[nodes['head', best].down, best]
                 currNode = choice[level]
@@ -220,17 +555,26 @@ class Dancer(object):
 
                 pp = nodes[currNode.row, currNode.right]
                 while pp.col != best:
-                    self.cover(pp.col)
+                    if pp.color:
+                        self.purify(pp)
+                    else:
+                        self.cover(pp.col)
                     pp = nodes[pp.row, pp.right]
                 if headers['root'].next == 'root':
 
-                    # record solution
+                    # report solution
 
-                    self._recorder(level, choice)
+                    self.found += 1
+                    try:
+                        yield level, choice
+                    except GeneratorExit:
+                        self._unwind(level, choice)
+                        raise
 
                     if findAll:
                         state = 'recover'   # goto recover
                     else:
+                        self._unwind(level, choice)
                         break               # done
                 else:
                     level += 1
@@ -241,6 +585,8 @@ class Dancer(object):
 
             if state == 'backup':
                 self.uncover(best)
+                if lazy and headers[best].lazy:
+                    self._contract(best)
                 if level == 0:
                     break                   # done
                 level   -= 1
@@ -257,11 +603,29 @@ class Dancer(object):
 
                 pp = nodes[currNode.row, currNode.left]
                 while pp.col != best:
-                    self.uncover(pp.col)
+                    if pp.color:
+                        self.unpurify(pp)
+                    else:
+                        self.uncover(pp.col)
                     pp = nodes[pp.row, pp.left]
                 currNode = choice[level] = nodes[currNode.down, currNode.col]
                 state    = 'advance'               # goto advance
 
+    def _unwind(self, level, choice):
+        # Uncover the rows choice[level], ..., choice[0] of a partial solution and their
+        # columns, returning the matrix to the state it was in before the search.
+
+        nodes = self.nodes
+        for idx in range(level, -1, -1):
+            currNode = choice[idx]
+            pp = nodes[currNode.row, currNode.left]
+            while pp.col != currNode.col:
+                self._uncommit(pp)
+                pp = nodes[pp.row, pp.left]
+            self.uncover(currNode.col)
+            if self.headers[currNode.col].lazy:
+                self._contract(currNode.col)
+
     def cover(self, col):
         # When a row is blocked, it leaves all lists except the list of the column that
         # is being covered.  Thus, a node is never removed fom a list twice. -- Knuth
@@ -269,10 +633,15 @@ class Dancer(object):
         updates = 1
         nodes   = self.nodes
         headers = self.headers
-        left    = headers[col].prev
-        right   = headers[col].next
+        buckets = self.buckets
+        h       = headers[col]
+        left    = h.prev
+        right   = h.next
         headers[left].next   = right               # remove col from the headers list
         headers[right].prev  = left
+        if h.queued:
+            buckets[h.length] ^= h.bit             # and from the bucket queue
+            h.queued = False
         rr = nodes['head', col].down               # next row in column
         while nodes[rr, col].row != 'head':
             nn = nodes[rr, nodes[rr, col].right]   # next column in row rr
@@ -282,7 +651,11 @@ class Dancer(object):
                 cc = nn.col
                 nodes[uu, cc].down = dd
                 nodes[dd, cc].up   = uu            # remove node from the column
-                headers[cc].length -= 1
+                h = headers[cc]
+                if h.queued:
+                    buckets[h.length] ^= h.bit
+                    buckets[h.length - 1] |= h.bit
+                h.length -= 1
                 updates += 1
                 nn = nodes[nn.row, nn.right]         #next column
             rr = nodes[rr, col].down                    # next row
@@ -295,6 +668,7 @@ class Dancer(object):
 
         nodes   = self.nodes
         headers = self.headers
+        buckets = self.buckets
         rr      = nodes['head', col].up             # last row in column
         while nodes[rr, col].row != 'head':
             nn = nodes[rr, nodes[rr, col].left]     # next column in row rr
@@ -303,12 +677,169 @@ class Dancer(object):
                 dd = nn.down
                 cc = nn.col
                 nodes[uu, cc].down = nodes[dd, cc].up = nn.row
-                headers[cc].length += 1
+                h = headers[cc]
+                if h.queued:
+                    buckets[h.length] ^= h.bit
+                    buckets[h.length + 1] |= h.bit
+                h.length += 1
                 nn = nodes[nn.row, nn.left]         #next column
             rr = nodes[rr, col].up                  # next row
-        left    = headers[col].prev
-        right   = headers[col].next
+        h       = headers[col]
+        left    = h.prev
+        right   = h.next
         headers[left].next = headers[right].prev = col #put col back into headers list
+        if h.primary and not h.seconded and buckets is not None:
+            buckets[h.length] |= h.bit
+            h.queued = True
+
+    def covered(self, col):
+        """Is the primary column col covered?"""
+
+        headers = self.headers
+        return headers[headers[col].prev].next != col
+
+    def _expand(self, col):
+        # Make the rows of the lazy column col, before the search branches on it.
+        # The rows with a column already covered are left out, and the others are
+        # linked in at the bottom of their columns, as readRows does.  The columns
+        # they may go in can be chosen for branching once no lazy column is left to
+        # add rows to them; until then _bestColumn passes them over, since they may
+        # be longer than they look.  A row made before, with the same name, gets
+        # its old number, so the numbers in the solutions stay valid.
+
+        nodes   = self.nodes
+        headers = self.headers
+        lazy    = headers[col].lazy
+        known   = self.lazyRows.setdefault(col, {})
+        covered = self.covered
+        added   = []
+        for row in lazy.rows(self):
+            if [cc for cc in row[:-1] if covered(cc)]:
+                continue
+            rowNum = known.get(row[-1])
+            if rowNum is None:
+                rowNum = known[row[-1]] = self.nextRow
+                self.nextRow += 1
+                self.rows[rowNum] = row[-1]
+                self.firstCol[rowNum] = row[0]
+            for i, c in enumerate(row[:-1]):
+                h = nodes['head', c]
+                nodes[rowNum, c] = Node(row[i-1], row[i+1], h.up, 'head', c, rowNum)
+                nodes[h.up, c].down = rowNum
+                h.up = rowNum
+                headers[c].length += 1
+            nodes[rowNum, c].right = row[0]
+            nodes[rowNum, row[0]].left = row[-2]
+            self.updates += len(row) - 1
+            added.append(rowNum)
+        for cc in lazy.support:
+            headers[cc].pending -= 1
+        self.expanded.append(added)
+
+    def _contract(self, col):
+        # Undo _expand(col), after col is uncovered
+
+        nodes   = self.nodes
+        headers = self.headers
+        for cc in headers[col].lazy.support:
+            headers[cc].pending += 1
+        for rowNum in reversed(self.expanded.pop()):
+            nn = nodes[rowNum, col]
+            while True:
+                cc = nn.col
+                nodes[nn.up, cc].down = nn.down
+                nodes[nn.down, cc].up = nn.up
+                headers[cc].length -= 1
+                del nodes[rowNum, cc]
+                if nn.right == col:
+                    break
+                nn = nodes[rowNum, nn.right]
+
+    def _commit(self, node):
+        # Cover the column of node, a 1 of a row put in the solution, or purify it if
+        # the 1 has a color
+
+        if node.color:
+            self.purify(node)
+        else:
+            self.cover(node.col)
+
+    def _uncommit(self, node):
+        # Undo _commit(node)
+
+        if node.color:
+            self.unpurify(node)
+        else:
+            self.uncover(node.col)
+
+    def purify(self, node):
+        # The colored counterpart of cover.  node is a 1 with a color in a secondary
+        # column, in a row put in the solution.  The other rows with a different color
+        # in the column are blocked, just as cover blocks rows; those with the same
+        # color are marked with color -1, so that choosing one of them later leaves
+        # the column alone.  A 1 already marked needs nothing done.
+
+        color = node.color
+        if color < 0:
+            return
+        col     = node.col
+        nodes   = self.nodes
+        headers = self.headers
+        buckets = self.buckets
+        updates = 0
+        rr = nodes['head', col].down               # next row in column
+        while rr != 'head':
+            qq = nodes[rr, col]
+            if qq.color == color:
+                if qq is not node:
+                    qq.color = -1
+            else:
+                nn = nodes[rr, qq.right]           # block the row
+                while nn.col != col:
+                    uu = nn.up
+                    dd = nn.down
+                    cc = nn.col
+                    nodes[uu, cc].down = dd
+                    nodes[dd, cc].up   = uu
+                    h = headers[cc]
+                    if h.queued:
+                        buckets[h.length] ^= h.bit
+                        buckets[h.length - 1] |= h.bit
+                    h.length -= 1
+                    updates += 1
+                    nn = nodes[rr, nn.right]
+            rr = qq.down
+        self.updates += updates
+
+    def unpurify(self, node):
+        # Undo purify(node), in precisely the reverse order
+
+        color = node.color
+        if color < 0:
+            return
+        col     = node.col
+        nodes   = self.nodes
+        headers = self.headers
+        buckets = self.buckets
+        rr = nodes['head', col].up                 # last row in column
+        while rr != 'head':
+            qq = nodes[rr, col]
+            if qq.color < 0:
+                qq.color = color
+            elif qq.color != color:
+                nn = nodes[rr, qq.left]            # unblock the row
+                while nn.col != col:
+                    uu = nn.up
+                    dd = nn.down
+                    cc = nn.col
+                    nodes[uu, cc].down = nodes[dd, cc].up = rr
+                    h = headers[cc]
+                    if h.queued:
+                        buckets[h.length] ^= h.bit
+                        buckets[h.length + 1] |= h.bit
+                    h.length += 1
+                    nn = nodes[rr, nn.left]
+            rr = qq.up
 
     def cover2(self, col):
         # Variant of cover() for covering a long column
@@ -342,10 +873,11 @@ class Dancer(object):
             headers[col].next      = col
             headers[col].prev      = col
             headers[col].seconded  = True
+            self._dequeue(col)
             seconded.append((col, left, right))
         rr = nodes['head', col].down               # next row in column
         while nodes[rr, col].row != 'head':
-            blocked.append(rr)
+            blocked.add(rr)
             nn = nodes[rr, nodes[rr, col].right]   # next node in row rr
             while nn.col != col:
 
@@ -370,6 +902,7 @@ class Dancer(object):
                     headers[cc].next     = cc
                     headers[cc].prev     = cc
                     headers[cc].seconded = True
+                    self._dequeue(cc)
                     seconded.append( (cc, left, right) )
 
                 nn = nodes[nn.row, nn.right]         #next node in the row
@@ -401,6 +934,17 @@ class Dancer(object):
             headers[col].prev     = left
             headers[col].next     = right
             headers[left].next    = headers[right].prev = col
+            if headers[col].primary and self.buckets is not None:
+                self.buckets[headers[col].length] |= headers[col].bit
+                headers[col].queued = True
+
+    def _dequeue(self, col):
+        # Take col out of the bucket queue, if it is there
+
+        h = self.headers[col]
+        if h.queued:
+            self.buckets[h.length] ^= h.bit
+            h.queued = False
 
     def report(self):
 
@@ -408,48 +952,888 @@ class Dancer(object):
 
         return [[self.rows[r] for r in s] for s in self.solutions]
 
-    def solve(self, findAll = True):
+    def iter_solutions(self, limit = None):
+        """Generate the solutions one at a time, each as a list of row names, as soon
+        as the search finds them.  The search is suspended between solutions, and
+        stops after limit solutions if a limit is given.  Closing the generator
+        early leaves the matrix as it was before the search."""
+
+        self._prefilter()
+        self.mode = 'iter'              # no checkpoints, since nothing is recorded
         rows = self.rows
-        longCols = []
-        if self.pattern is not None:
-            pattern = self.pattern
-            headers = self.headers
-            bound = self.bound
-            longCols = [col for col in headers if pattern.match(col) \
-                        and headers[col].length > bound]
-        if longCols:
-            self.seconded = []
-            self.blocked  = []
+        solutions = self._dance(True)
+        try:
+            for num, (level, choice) in enumerate(solutions):
+                yield [rows[choice[idx].row] for idx in range(0, level+1)]
+                if limit is not None and num + 1 >= limit:
+                    break
+        finally:
+            solutions.close()
+
+    def count(self, limit = None, max_updates = None, max_nodes = None, deadline = None,
+              cancel = None):
+        """Return the number of solutions, without recording them.  If a limit is given,
+        the search stops as soon as that many have been found.  The other arguments
+        are as for solve(); if one stops the search, the count so far is returned, and
+        self.result says why."""
+
+        self.setLimits(max_updates, max_nodes, deadline, cancel)
+        self._prefilter()
+        self.found = 0
+        if self.stopped is None:
+            self._count(limit)
+        self._setResult()
+        return self.found
+
+    def _count(self, limit, stack = None):
+        # Count solutions, continuing from self.found, which checkpoints save
+
+        self.mode = 'count'
+        self.limit = limit
+        solutions = self._dance(True, stack)
+        try:
+            for level, choice in solutions:
+                if self.found == limit:
+                    break
+        finally:
+            solutions.close()
+        return self.found
+
+    def is_unique(self):
+        """Does the problem have exactly one solution?  The search stops at the second."""
+
+        return self.count(limit = 2) == 1
+
+    def zdd(self, maxMemo = 100000):
+        """Build a ZDD of all the solutions, by Knuth's DXZ.  This is the search of
+        backTrack, except that the subproblem below each node of the search tree,
+        which depends only on the columns covered so far, is looked up in a memo and
+        only searched the first time it comes up.  The time is about proportional to
+        the size of the ZDD rather than to the number of solutions.
+
+        The memo holds at most maxMemo subproblems.  When it is full, the one least
+        recently used is forgotten; that only costs time, since the ZDD node for it
+        is kept, and is found again if the subproblem is searched again.
+
+        Returns the ZDD, which is also kept in self.diagram."""
+
+        if self.lazy:
+            raise ValueError("zdd() doesn't support lazy columns")
+        self._prefilter()
+        bits = {}
+        for bit, col in enumerate(self.columns):
+            bits[col] = 1 << bit
+        self.rowMask = {}           # the columns of each row, as a bit set
+        for rowNum, row in enumerate(self.matrix):
+            mask = 0
+            for col in row[:-1]:
+                if col not in bits:
+                    bits[col] = 1 << len(bits)      # a column with a color
+                mask |= bits[col]
+            self.rowMask[rowNum] = mask
+        self.diagram = diagram = ZDD()
+        diagram.root = self._zdd(0, diagram, OrderedDict(), maxMemo)
+        return diagram
+
+    def _zdd(self, covered, diagram, memo, maxMemo):
+        # The ZDD node for the solutions of the subproblem left when the columns in
+        # the bit set covered are covered.  The rows of the best column are taken
+        # last to first, so that the node for each has the node for the rest as lo.
+        # A column purified with a color has a bit for the pair (column, color),
+        # since the subproblem depends on the color.
+
+        node = memo.pop(covered, None)
+        if node is not None:
+            memo[covered] = node        # it is now the most recently used
+            return node
+        self.nodeCount += 1
+        best = self._bestColumn()
+        if best is None:
+            return ZDD.TOP
+        nodes = self.nodes
+        rows = []
+        rr = nodes['head', best].down
+        while rr != 'head':
+            rows.append(rr)
+            rr = nodes[rr, best].down
+        self.cover(best)
+        node = ZDD.BOTTOM
+        for rr in reversed(rows):
+            pp = nodes[rr, nodes[rr, best].right]
+            while pp.col != best:
+                self._commit(pp)
+                pp = nodes[rr, pp.right]
+            hi = self._zdd(covered | self.rowMask[rr], diagram, memo, maxMemo)
+            pp = nodes[rr, nodes[rr, best].left]
+            while pp.col != best:
+                self._uncommit(pp)
+                pp = nodes[rr, pp.left]
+            node = diagram.node(rr, node, hi)
+        self.uncover(best)
+        memo[covered] = node
+        if len(memo) > maxMemo:
+            memo.popitem(last = False)
+        return node
+
+    def countAll(self, maxMemo = 100000):
+        """The number of solutions, counted with the ZDD of zdd(), which is built if it
+        has not been.  For problems with too many solutions to list."""
+
+        if self.diagram is None:
+            self.zdd(maxMemo)
+        return self.diagram.count()
+
+    def sample(self, num = 1, seed = None, maxMemo = 100000):
+        """num solutions, each chosen uniformly at random from all of them, as lists of
+        row names, using the ZDD of zdd(), which is built if it has not been."""
+
+        if self.diagram is None:
+            self.zdd(maxMemo)
+        rand = random.Random(seed)
+        rows = self.rows
+        samples = []
+        for n in range(num):
+            solution = self.diagram.sample(rand)
+            if solution is None:
+                break
+            samples.append([rows[r] for r in solution])
+        return samples
+
+    def solve(self, findAll = True, processes = 1, depth = 1, max_updates = None,
+              max_nodes = None, deadline = None, cancel = None):
+        # With processes > 1 the search is split among a pool of that many worker
+        # processes (processes = 0 means one per CPU).  Each worker searches the
+        # subproblems left after fixing the first depth choices of the search tree.
+
+        # The search stops early after max_updates more updates, or max_nodes more nodes,
+        # or at the time deadline (as from time.time()), or when the CancelToken cancel
+        # is set.  They are checked before the search and at every node, but the clock
+        # only every clockUpdates updates.  The solutions found so far are kept, and
+        # self.result tells whether the search was complete.  The limits apply to
+        # the pre-pass, and to single-process searches only.
+
+        if processes != 1 and self.lazy:
+            raise ValueError("Lazy columns need a single process")
+        self.setLimits(max_updates, max_nodes, deadline, cancel)
+        self._prefilter(oneSolution = not findAll)
+        if self.stopped is not None:
+            pass                        # stopped in the pre-pass
+        elif processes == 1:
+            self.backTrack(findAll)
+        else:
+            self._solveParallel(findAll, processes or multiprocessing.cpu_count(), depth)
+        self._setResult()
+        return self.updates
 
-            for col in longCols:
-                self.cover2(col)    # computes self.seconded and self.blocked
+    def prepare(self, cancel = None):
+        """Reduce the matrix as solve() does before the search: preprocess it, if
+        preprocess is set, and do the iterated dancing links pre-pass.  It is only done
+        once, so solve() and the rest will not do it again.  If the CancelToken cancel
+        is set during the pre-pass, it stops, and is done over by the next search."""
+
+        self.setLimits(cancel = cancel)
+        self._prefilter()
+        self.setLimits()
+
+    def setLimits(self, max_updates = None, max_nodes = None, deadline = None, cancel = None):
+        # Set the limits checked by _checkLimits, counting from now
+
+        self.maxUpdates = None if max_updates is None else self.updates + max_updates
+        self.maxNodes = None if max_nodes is None else self.nodeCount + max_nodes
+        self.deadline = deadline
+        self.cancel = cancel
+        self.limited = not (max_updates is None and max_nodes is None and deadline is None
+                            and cancel is None)
+        self.nextClock = self.updates  # when to look at the clock next
+        self.stopped = None         # the reason the search stopped early
+
+    def _setResult(self):
+        self.result = Result(self.stopped is None, self.stopped, self.found, self.nodeCount,
+                             self.updates)
+        self.setLimits()
+
+    def _solveParallel(self, findAll, processes, depth):
+        # Farm the branches out to the pool.  For all solutions, the results are
+        # collected in branch order, so the solutions come out in the same order as
+        # from backTrack.  For one solution, the first worker to find one wins, and
+        # the pool is terminated, cancelling the others.  Each worker also sends back
+        # its solutions found and nodes visited, which are added to found and nodeCount;
+        # the nodes above the branches are counted by _branches.
+
+        tasks = [(prefix, findAll) for prefix in self._branches([], depth)]
+        pool = multiprocessing.Pool(processes, _initWorker,
+                                    (self.primary, self.matrix, self.secondary, sorted(self.deleted),
+                                     self.strategy))
+        try:
+            if findAll:
+                for solutions, updates, found, nodes in pool.imap(_searchBranch, tasks):
+                    self.solutions.extend(solutions)
+                    self.updates += updates
+                    self.found += found
+                    self.nodeCount += nodes
+            else:
+                for solutions, updates, found, nodes in pool.imap_unordered(_searchBranch, tasks):
+                    self.updates += updates
+                    self.nodeCount += nodes
+                    if solutions:
+                        self.solutions.append(solutions[0])
+                        self.found += 1
+                        break
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _branches(self, prefix, depth):
+        # Generate the partial solutions with depth rows, choosing columns as backTrack
+        # does, as lists of row numbers.  A shorter list is generated if it already
+        # covers every column; dead ends generate nothing.  Each branch must be used
+        # before the next is generated, since the matrix changes in between.
+
+        best = self._bestColumn()
+        if best is None or depth == 0:
+            yield prefix
+            return
+        self.nodeCount += 1
+        nodes = self.nodes
+        rr = nodes['head', best].down
+        while rr != 'head':
+            self._force(rr)
+            for branch in self._branches(prefix + [rr], depth - 1):
+                yield branch
+            self._release(rr)
+            rr = nodes[rr, best].down
+
+    def _searchBranch(self, prefix, findAll):
+        # Search the subproblem left after choosing the rows in prefix.
+        # Returns the solutions, as lists of row numbers, and the numbers of updates,
+        # solutions found and nodes visited.  The updates and nodes for choosing the
+        # prefix were already counted by _branches.
+
+        for row in prefix:
+            self._force(row)
+        updates, found, nodeCount = self.updates, self.found, self.nodeCount
+        solutions = []
+        for level, choice in self._dance(findAll):
+            solutions.append(prefix + [choice[idx].row for idx in range(0, level+1)])
+        for row in reversed(prefix):
+            self._release(row)
+        return solutions, self.updates - updates, self.found - found, self.nodeCount - nodeCount
+
+    def estimate(self, samples = 100, seed = None, max_updates = None, deadline = None,
+                 cancel = None):
+        """Estimate the size of the search, without doing it, by Knuth's Monte Carlo
+        method.  Each sample follows one random path from the root of the search tree to
+        a leaf, using the same column choices and cover/uncover as the search.  If the
+        nodes on the path have d0, d1, ... children, the path stands for d0 * d1 * ... * dk
+        nodes at depth k+1, and for that many times the updates done there.  The mean over
+        the samples is an unbiased estimate of the size of the whole tree.
+
+        A sample can cost a good part of the search itself, so fewer samples are taken
+        if they use up max_updates updates, or the time reaches deadline, or the
+        CancelToken cancel is set.  These are checked after each sample; at least one
+        is taken.  Call prepare() first to estimate the search that solve() will do.
+
+        Returns an Estimate of the number of nodes (as counted in nodeCount), updates and
+        solutions.  The matrix, and the updates count, are left as they were."""
+
+        rand = random.Random(seed)
+        nodes = self.nodes
+        updates = self.updates
+        nodeSamples = []
+        updateSamples = []
+        solutions = 0.0
+        for sample in range(samples):
+            if sample and (max_updates is not None and self.updates - updates >= max_updates or
+                           deadline is not None and time.time() >= deadline or
+                           cancel is not None and cancel.isSet()):
+                break
+            weight = 1      # the number of tree nodes this path's current node stands for
+            nodeCount = 0
+            updateCount = 0
+            choice = {}
+            level = 0
+            while True:
+                best = self._bestColumn()
+                if best is None:
+                    solutions += weight
+                    break
+                nodeCount += weight
+                before = self.updates
+                if self.headers[best].lazy:
+                    self._expand(best)
+                self.cover(best)
+                updateCount += weight * (self.updates - before)
+                length = self.headers[best].length
+                if length == 0:
+                    self.uncover(best)
+                    if self.headers[best].lazy:
+                        self._contract(best)
+                    break
+                rr = nodes['head', best].down
+                for n in range(rand.randrange(length)):
+                    rr = nodes[rr, best].down
+                choice[level] = currNode = nodes[rr, best]
+                weight *= length
+                before = self.updates
+                pp = nodes[rr, currNode.right]
+                while pp.col != best:
+                    self._commit(pp)
+                    pp = nodes[rr, pp.right]
+                updateCount += weight * (self.updates - before)
+                level += 1
+            self._unwind(level - 1, choice)
+            nodeSamples.append(nodeCount)
+            updateSamples.append(updateCount)
+        self.updates = updates
+
+        def meanError(values):
+            # the mean and the half-width of its 95% confidence interval
+            mean = sum(values) / float(len(values))
+            if len(values) < 2:
+                return mean, float('inf')
+            variance = sum([(x - mean) ** 2 for x in values]) / (len(values) - 1)
+            return mean, 1.96 * math.sqrt(variance / len(values))
+
+        nodeMean, nodeError = meanError(nodeSamples)
+        updateMean, updateError = meanError(updateSamples)
+        return Estimate(nodeMean, nodeError, updateMean, updateError, solutions / len(nodeSamples))
+
+    def setCheckpoint(self, fname, nodes = None, seconds = None):
+        """Save the state of the search in the file fname every so many nodes of the
+        search tree, or every so many seconds, or both, during solve() and count().
+        resume() can continue the search from the file, in this process or another,
+        after a crash or an interrupt; the search since the last save is done over."""
+
+        if self.lazy:
+            raise ValueError("Lazy columns can't be checkpointed")
+        self.checkpointFile = fname
+        self.checkpointNodes = nodes
+        self.checkpointSeconds = seconds
+
+    def _scheduleCheckpoint(self):
+        # Set when the next checkpoint is due
+
+        self.nextSave = None
+        self.saveTime = None
+        if self.checkpointing:
+            if self.checkpointNodes is not None:
+                self.nextSave = self.nodeCount + self.checkpointNodes
+            if self.checkpointSeconds is not None:
+                self.saveTime = time.time() + self.checkpointSeconds
+        self._setNextCheck()
+
+    def _setNextCheck(self):
+        # _dance calls _periodic when nodeCount reaches nextCheck.  The clock is only
+        # looked at for a checkpoint every 1000 nodes.
+
+        nextCheck = self.nodeCount + 1000
+        if self.nextSave is not None:
+            nextCheck = min(nextCheck, self.nextSave)
+        self.nextCheck = nextCheck
+
+    def _periodic(self, findAll, level, choice):
+        # Called by _dance at a forward step, when choice[0..level-1] are in the
+        # partial solution and the subtree below them is about to be searched.
+        # Saves a checkpoint if one is due.
+
+        if self.checkpointing and \
+           ((self.nextSave is not None and self.nodeCount >= self.nextSave) or \
+            (self.saveTime is not None and time.time() >= self.saveTime)):
+            self.saveCheckpoint(findAll, [(choice[idx].row, choice[idx].col) for idx in range(level)])
+            self._scheduleCheckpoint()
+        else:
+            self._setNextCheck()
+
+    def _checkLimits(self):
+        # Called by _dance before the search and at every forward step when there are
+        # limits; raises SearchStopped if one has been reached.  A node of a kenken
+        # search can cost thousands of updates, so the token, the nodes and the
+        # updates are checked every time, as that is cheap.  The clock is only looked
+        # at every clockUpdates updates.
+
+        if self.cancel is not None and self.cancel.isSet():
+            raise SearchStopped('cancelled')
+        if self.maxNodes is not None and self.nodeCount >= self.maxNodes:
+            raise SearchStopped('max_nodes')
+        if self.maxUpdates is not None and self.updates >= self.maxUpdates:
+            raise SearchStopped('max_updates')
+        if self.deadline is not None and self.updates >= self.nextClock:
+            self.nextClock = self.updates + self.clockUpdates
+            if time.time() >= self.deadline:
+                raise SearchStopped('deadline')
+
+    def saveCheckpoint(self, findAll, stack):
+        # Write the state of the search to the checkpoint file.  It goes to a
+        # temporary file first, so that a crash while writing loses nothing.
+
+        state = {'rows':      len(self.rows),
+                 'columns':   self.columns,
+                 'deleted':   sorted(self.deleted),
+                 'mode':      self.mode,
+                 'findAll':   findAll,
+                 'limit':     self.limit,
+                 'stack':     stack,
+                 'solutions': self.solutions,
+                 'found':     self.found,
+                 'updates':   self.updates,
+                 'nodes':     self.nodeCount}
+        fname = self.checkpointFile
+        fout = open(fname + '.tmp', 'wb')
+        cPickle.dump(state, fout, 2)
+        fout.close()
+        if os.path.exists(fname):
+            os.remove(fname)            # rename won't replace a file on Windows
+        os.rename(fname + '.tmp', fname)
+
+    def resume(self, fname):
+        """Continue a search from a checkpoint file saved by a Dancer built from the same
+        primary, matrix and secondary arguments.  Returns what the interrupted call
+        would have: the number of updates for solve(), the number of solutions for
+        count().  Checkpoints continue to be saved in fname, unless setCheckpoint
+        has been called with another file."""
+
+        fin = open(fname, 'rb')
+        state = cPickle.load(fin)
+        fin.close()
+        if state['rows'] != len(self.rows) or state['columns'] != self.columns:
+            raise ValueError("Checkpoint %s is for a different problem" % fname)
+        for row in state['deleted']:
+            if row not in self.deleted:
+                self.deleteRow(row)
+        self.prefiltered = True
+        self.solutions = state['solutions']
+        self.found     = state['found']
+        self.updates   = state['updates']
+        self.nodeCount = state['nodes']
+        if self.checkpointFile is None:
+            self.setCheckpoint(fname, 100000)
+        if state['mode'] == 'count':
+            self._count(state['limit'], state['stack'])
+            self._setResult()
+            return self.found
+        self.backTrack(state['findAll'], state['stack'])
+        self._setResult()
+        return self.updates
 
-            self.backTrack(findAll)
-            goodRows = set(reduce(lambda x,y:x+y,self.solutions,[]))
+    def _bestColumn(self):
+        # The column to branch on: the shortest, or None if all are covered.
+        # Ties go to the column that comes first in the header list, so the
+        # search, and the number of updates, is the same from run to run.
+        # A strategy, if there is one, makes the choice instead.
+
+        if self.lazy:
+            return self._bestLazyColumn()
+        if self.strategy is not None:
+            return self.strategy.choose(self)
+        if self.buckets is not None:
+            for bucket in self.buckets:
+                if bucket:
+                    return self.byBit[(bucket & -bucket).bit_length() - 1]
+            return None
 
-            # put the matrix back in its original condition
+        headers = self.headers
+        best = None
+        minLength = 10000000  # infinity
+        cur = headers['root'].next
+        while cur != 'root':
+            h = headers[cur]
+            if h.length < minLength:
+                best      = cur
+                minLength = h.length
+            cur = h.next
+        return best
+
+    def _bestLazyColumn(self):
+        # _bestColumn when there are lazy columns.  A column that a lazy column not
+        # yet expanded may add rows to is passed over, and a lazy column not yet
+        # expanded is taken to have the length of its estimate.  Strategies and
+        # buckets are not used.  The columns passed over can't just be given a bound:
+        # the search would cover one before the lazy rows in it were made, and lose
+        # the solutions with them.  So the fewer columns the lazy columns support, the
+        # better; when they support most columns, the search branches mostly on the
+        # lazy columns, and is much longer than with all the rows made at the start.
 
-            for col in reversed(longCols):
-                self.uncover2(col)
-            self.unsecond()
+        headers = self.headers
+        best = None
+        minLength = 10000000  # infinity
+        cur = headers['root'].next
+        while cur != 'root':
+            h = headers[cur]
+            if not h.pending:
+                length = h.lazy.estimate if h.lazy else h.length
+                if length < minLength:
+                    best      = cur
+                    minLength = length
+            cur = h.next
+        return best
+
+    def shortestColumns(self):
+        """The primary columns of the least length, in header list order.  A column of
+        length 0 is returned alone, since the search can go no further."""
+
+        if self.buckets is not None:
+            for length, bucket in enumerate(self.buckets):
+                if bucket:
+                    ties = []
+                    while bucket:
+                        low = bucket & -bucket
+                        ties.append(self.byBit[low.bit_length() - 1])
+                        if length == 0:
+                            break
+                        bucket ^= low
+                    return ties
+            return []
 
-            # delete useless rows
+        headers = self.headers
+        ties = []
+        minLength = 10000000  # infinity
+        cur = headers['root'].next
+        while cur != 'root':
+            h = headers[cur]
+            if h.length < minLength:
+                if h.length == 0:
+                    return [cur]
+                ties = [cur]
+                minLength = h.length
+            elif h.length == minLength:
+                ties.append(cur)
+            cur = h.next
+        return ties
+
+    def _force(self, row, col = None):
+        # Put row in the solution, by covering all its columns, starting with col
 
-            for row in self.rows:
-                if row not in goodRows and row not in self.blocked:
-                    self.deleteRow(row)
+        nodes = self.nodes
+        if col is None:
+            col = self.firstCol[row]
+        self._commit(nodes[row, col])
+        pp = nodes[row, nodes[row, col].right]
+        while pp.col != col:
+            self._commit(pp)
+            pp = nodes[row, pp.right]
 
-            self.solutions = []        # erase the partial solutions
+    def _release(self, row):
+        # Undo _force(row)
 
-        self.backTrack(findAll)
-        return self.updates
+        nodes = self.nodes
+        col = self.firstCol[row]
+        pp = nodes[row, nodes[row, col].left]
+        while pp.col != col:
+            self._uncommit(pp)
+            pp = nodes[row, pp.left]
+        self._uncommit(nodes[row, col])
+
+    def _prefilter(self, oneSolution = False):
+        # The iterated dancing links pre-pass.  Long columns are temporarily excluded
+        # from the problem, and rows that belong to no partial solution of what is left
+        # are deleted.  The partial solutions are searched for until every row is in
+        # one, or there are no more, whether or not the caller wants all the solutions.
+        # It is only done once for any Dancer.  If the caller wants only one solution,
+        # preprocess deletes duplicate rows as well; after that, a search for all the
+        # solutions, or a count, would miss some, and raises ValueError.
+
+        # If pattern is a list, each pattern defines a group of long columns, and the
+        # groups are excluded in turn, one pass each.  The passes are repeated, in
+        # rounds, until a round deletes no rows: after rows are deleted, a column may
+        # no longer be long, or the partial solutions for another group may be fewer,
+        # so the next round may delete more.  A pass is skipped if neither its long
+        # columns nor the rows have changed since its last pass, since it would delete
+        # nothing.  Each pass done is recorded in self.rounds.  If a limit stops a
+        # pass, the pre-pass stops, and is done again by the next search.
+
+        if self.prefiltered:
+            if not oneSolution and self.reduction is not None and self.reduction.duplicates:
+                raise ValueError("Duplicate rows were deleted to find one solution; "
+                                 "reset() to find them all")
+            return
+        self.prefiltered = True
+        if self.lazy:
+            return                      # the rows are not all there to filter
+        if self.usePreprocess and self.reduction is None:
+            self.preprocess(duplicates = oneSolution)
+        if self.pattern is None:
+            return
+        patterns = self.pattern
+        if not isinstance(patterns, (list, tuple)):
+            patterns = [patterns]
+        if self.bound == 'auto' and not self._planPrefilter(patterns):
+            return
+        checkpointFile = self.checkpointFile
+        self.checkpointFile = None      # the pre-pass is not checkpointed
+        found = self.found              # the partial solutions are not solutions
+        lastPass = {}                   # group -> (its long columns, rows deleted then)
+        roundNum = 0
+        while True:
+            roundNum += 1
+            deleted = 0
+            for group, pattern in enumerate(patterns):
+                longCols = self._longColumns(pattern)
+                if longCols and lastPass.get(group) != (longCols, len(self.deleted)):
+                    if self.limited:
+                        try:
+                            self._checkLimits()     # before the pass covers anything
+                        except SearchStopped, e:
+                            self.stopped = e.args[0]
+                            break
+                    deleted += self._prefilterPass(longCols, roundNum, group)
+                    lastPass[group] = (longCols, len(self.deleted))
+                if self.stopped is not None:
+                    break
+            if self.stopped is not None:
+                self.prefiltered = False
+                break
+            if not deleted:
+                break
+        self.found = found
+        self.checkpointFile = checkpointFile
+
+    def preprocess(self, duplicates = False):
+        """Reduce the matrix before the search, by deleting rows that cannot be in any
+        solution.  A pass applies each of these rules in turn, and passes are repeated
+        until one deletes nothing:
+
+          - a row alone in a primary column is forced: it is in every solution, so the
+            rows that share a column with it are deleted,
+          - a row that shares a column with every row of some primary column is
+            deleted, since choosing it would leave that column with no row to cover it,
+          - if duplicates is True, a row with the same columns as an earlier row is
+            deleted,
+          - if every row of a primary column A is also in a column B, then B is
+            covered whenever A is, so the rows of B not in A are deleted.
+
+        Rows that give a secondary column the same color do not conflict there, and
+        the last rule is not applied to columns B with colors.
+
+        The forced rows are kept: they are alone in all their columns, so the search
+        chooses them first, without branching.  Deleting duplicates loses solutions
+        that differ only in which of the duplicates they use, so it is only for finding
+        one solution: count() and is_unique() would be wrong after it.  The other rules
+        lose no solutions.
+        If a primary column is left with no rows there are no solutions, and the
+        reduction stops there.
+
+        It is meant to be done once, before the search; _prefilter does it first if
+        the Dancer was made with preprocess = True.  Returns the Reduction, which is
+        also kept in self.reduction."""
+
+        if self.lazy:
+            raise ValueError("preprocess() doesn't support lazy columns")
+        matrix  = self.matrix
+        primary = [col for col in self.primary if not self.headers[col].seconded]
+        colRows = dict.fromkeys(self.columns, 0)    # the rows of each column, as a bit set
+        colorRows = {}                              # the rows of each (column, color)
+        live = 0                                    # the rows left, as a bit set
+        for row in self.rows:
+            if row not in self.deleted:
+                bit = 1 << row
+                live |= bit
+                for col in matrix[row][:-1]:
+                    if type(col) is tuple:
+                        colorRows[col] = colorRows.get(col, 0) | bit
+                        col = col[0]
+                    colRows[col] |= bit
+        colored = set([col for col, color in colorRows])
+        counts = {'conflicts': 0, 'blocking': 0, 'duplicates': 0, 'dominated': 0}
+        dropped = []
+        forced = set()
+
+        def conflicts(row):
+            # the rows that share a column with row, including row
+            blocked = 1 << row
+            for col in matrix[row][:-1]:
+                if type(col) is tuple:
+                    blocked |= colRows[col[0]] & ~colorRows[col]
+                else:
+                    blocked |= colRows[col]
+            return blocked
+
+        def drop(rows, reason):
+            # delete the rows in the bit set rows from colRows; the caller takes
+            # them out of live
+            while rows:
+                low = rows & -rows
+                rows ^= low
+                row = low.bit_length() - 1
+                for col in matrix[row][:-1]:
+                    if type(col) is tuple:
+                        colorRows[col] &= ~low
+                        col = col[0]
+                    colRows[col] &= ~low
+                dropped.append(row)
+                counts[reason] += 1
+
+        passes = 0
+        changed = True
+        while changed and 0 not in [colRows[col] for col in primary]:
+            passes += 1
+            changed = False
+
+            for col in primary:
+                rows = colRows[col]
+                if rows and rows & (rows - 1) == 0:
+                    row = rows.bit_length() - 1
+                    if row not in forced:
+                        forced.add(row)
+                        rows = conflicts(row) & ~rows
+                        if rows:
+                            drop(rows, 'conflicts')
+                            live &= ~rows
+                            changed = True
+
+            # The rows that conflict with every row of col are the intersection of
+            # the conflicts of its rows.  Deleting rows only takes them out of the
+            # conflicts of the others, so those found in this pass stay good with
+            # & live.
+
+            conflict = {}
+            for col in primary:
+                rows = colRows[col]
+                common = live & ~rows
+                while rows and common:
+                    low = rows & -rows
+                    rows ^= low
+                    row = low.bit_length() - 1
+                    if row not in conflict:
+                        conflict[row] = conflicts(row)
+                    common &= conflict[row]
+                if common and colRows[col]:
+                    drop(common, 'blocking')
+                    live &= ~common
+                    changed = True
+
+            seen = set()
+            rows = duplicates and live
+            while rows:
+                low = rows & -rows
+                rows ^= low
+                key = tuple(sorted(matrix[low.bit_length() - 1][:-1]))
+                if key in seen:
+                    drop(low, 'duplicates')
+                    live &= ~low
+                    changed = True
+                seen.add(key)
+
+            for col in primary:
+                rows = colRows[col]
+                if not rows:
+                    break
+                first = (rows & -rows).bit_length() - 1
+                for other in matrix[first][:-1]:
+                    if type(other) is tuple or other in colored:
+                        continue
+                    extra = colRows[other] & ~rows
+                    if other != col and extra and rows & ~colRows[other] == 0:
+                        drop(extra, 'dominated')
+                        live &= ~extra
+                        changed = True
+
+        nodes = 0
+        for row in dropped:
+            nodes += len(matrix[row]) - 1
+            self.deleteRow(row)
+        self.reduction = Reduction(passes, len(forced), counts['conflicts'], counts['blocking'],
+                                   counts['duplicates'], counts['dominated'], len(dropped), nodes)
+        return self.reduction
+
+    def _planPrefilter(self, patterns):
+        # Choose the bound, for bound = 'auto', and return whether to do the pre-pass.
+        # The columns to exclude are those matching a pattern that are more than twice
+        # as long as the median primary column, the longest planColumns of them if
+        # there are more.  Excluding them blocks their rows, so the nodes in those rows
+        # are what the pass costs to set up, and what it leaves out of the problem it
+        # searches.  If they are most of the matrix, more than planShare of its nodes,
+        # the pass is cheap next to the search, and is done.  Otherwise the partial
+        # solutions are nearly as hard to find as the solutions, and it is not.
+
+        # This was chosen over estimating the search with estimate(), since on kenken
+        # matrices a few sample paths cost about as much as the whole search.
 
-    def deleteRow(self, row):
+        headers = self.headers
         nodes   = self.nodes
+        lengths = sorted([headers[col].length for col in self.primary])
+        median  = lengths[len(lengths) // 2]
+        candidates = [col for col in self.columns if headers[col].length > 2 * median and
+                      [pattern for pattern in patterns if pattern.match(col)]]
+        candidates.sort(key = lambda col: -headers[col].length)
+        longCols = candidates[:self.planColumns]
+
+        excluded = 0
+        blocked = set()
+        for col in longCols:
+            rr = nodes['head', col].down
+            while rr != 'head':
+                if rr not in blocked:
+                    blocked.add(rr)
+                    excluded += len(self.matrix[rr]) - 1
+                rr = nodes[rr, col].down
+        total = sum([headers[col].length for col in self.columns])
+
+        if longCols and excluded > self.planShare * total:
+            self.bound = headers[longCols[-1]].length - 1
+            self.plan = Plan(True, self.bound, longCols, excluded, total)
+            return True
+        self.bound = max([headers[col].length for col in self.columns])
+        self.plan = Plan(False, self.bound, longCols, excluded, total)
+        return False
+
+    def _longColumns(self, pattern):
+        # The columns that match pattern and are longer than the bound
+
         headers = self.headers
+        bound = self.bound
+        return [col for col in self.columns if pattern.match(col) \
+                and headers[col].length > bound]
+
+    def _prefilterPass(self, longCols, roundNum, group):
+        # One pass of the pre-pass, excluding the columns longCols.
+        # Returns the number of rows deleted.
+
+        updates = self.updates
+        self.seconded = []
+        self.blocked  = set()
+
+        for col in longCols:
+            self.cover2(col)    # computes self.seconded and self.blocked
+
+        # Mark the rows of each partial solution as it is found, rather than keeping
+        # them all, and stop as soon as every row that is left is marked.
+
+        candidates = len(self.rows) - len(self.blocked) - len(self.deleted)
+        goodRows = set()
+        search = self._dance(True)
+        for level, choice in search:
+            for idx in range(level + 1):
+                goodRows.add(choice[idx].row)
+            if len(goodRows) == candidates:
+                search.close()      # uncovers the partial solution
+                break
+
+        # put the matrix back in its original condition
+
+        for col in reversed(longCols):
+            self.uncover2(col)
+        self.unsecond()
+        if self.stopped is not None:
+            return 0                # not all the partial solutions were found
+
+        # delete useless rows
+
+        blocked = self.blocked
+        deleted = nodes = 0
+        for row in self.rows:
+            if row not in goodRows and row not in blocked and row not in self.deleted:
+                nodes += len(self.matrix[row]) - 1
+                deleted += 1
+                self.deleteRow(row)
+        self.rounds.append(Round(roundNum, group, len(longCols), deleted, nodes,
+                                 self.updates - updates))
+        return deleted
+
+    def deleteRow(self, row):
+        nodes   = self.nodes
         updates = 0
-        for col in headers:
-            if (row, col) in nodes: break
+        self.deleted.add(row)
+        col = self.firstCol[row]
         nn = nodes[row, nodes[row, col].right]   # next column in row rr
         while nn.col != col:
             uu = nn.up
@@ -457,7 +1841,7 @@ class Dancer(object):
             cc = nn.col
             nodes[uu, cc].down = dd
             nodes[dd, cc].up   = uu              # remove node from the column
-            headers[cc].length -= 1
+            self._shorten(cc)
             nn = nodes[nn.row, nn.right]     #next column
             updates += .5                        # this update won't be undone
 
@@ -468,9 +1852,18 @@ class Dancer(object):
         cc = nn.col
         nodes[uu, cc].down = dd
         nodes[dd, cc].up   = uu
-        headers[cc].length -= 1
+        self._shorten(cc)
         self.updates += int(updates + 1.1)
 
+    def _shorten(self, col):
+        # Decrease the length of col by one, moving it to its new bucket
+
+        h = self.headers[col]
+        if h.queued:
+            self.buckets[h.length] ^= h.bit
+            self.buckets[h.length - 1] |= h.bit
+        h.length -= 1
+
     def printColumn(self, col):
         rows    = self.rows
         nodes   = self.nodes
@@ -479,7 +1872,7 @@ class Dancer(object):
         rr = nodes['head', col].down
         while rr != 'head':
             row = rows[rr]
-            print "    %s" % ' '.join([row[i:i+3] for i in range(0, len(row), 3)])
+            print "    %s" % (row,)
             rr = nodes[rr, col].down
 
     def printHeaders(self):
@@ -491,8 +1884,429 @@ class Dancer(object):
             col = headers[col].next
         print
 
+# Worker process side of Dancer.solve(processes = n).  Each worker builds its own copy
+# of the problem once, and reuses it for every branch it is sent.
+
+_dancer = None
+
+def _initWorker(primary, matrix, secondary, deleted, strategy):
+    global _dancer
+    _dancer = Dancer(primary, matrix, secondary, strategy = strategy)
+    for row in deleted:
+        _dancer.deleteRow(row)
+    _dancer.prefiltered = True
+
+def _searchBranch(task):
+    prefix, findAll = task
+    return _dancer._searchBranch(prefix, findAll)
 
+class ArrayDancer(object):
+    # Dancing links with the matrix held in flat lists instead of a dict of Nodes.
 
+    # Columns and rows are dense integer IDs.  Slot 0 is the root, slots 1 through
+    # len(columns) are the column headers, in the order given, and the remaining
+    # slots are the 1's of the matrix, row by row.  For each slot k, L[k], R[k],
+    # U[k] and D[k] are the slots of its neighbours, C[k] is the slot of its
+    # column header and ROW[k] is its row number (-1 for the root and headers).
+    # S[c] is the length of column c.  Every pointer hop is then a list index
+    # instead of hashing a (row, column name) tuple.
 
+    # The interface is the same as Dancer's: construct, then solve() and report().
 
+    def __init__(self, primary, matrix, secondary = [], bound = 42000, pattern = None):
+        if primary == []:
+            raise RuntimeError("No primary columns!")
+        if matrix == []:
+            raise RuntimeError("No membership matrix")
+        self.columns = primary + secondary
+        index = self.index = {}         # column name -> header slot
+        for slot, col in enumerate(self.columns):
+            index[col] = slot + 1
+        for row in matrix:
+            for col in row[:-1]:
+                if not col in index:
+                    raise ColumnError(col)
+        self.rows = []                  # symbolic row names, by row number
+        self.rowStart = []              # slot of the first 1 in each row
+        self.updates = 0
+        self.solutions = []
+        self.bound = bound
+        self.pattern = pattern
+        self.nPrimary = len(primary)
+        self.plan = None                # the Plan, if the bound is 'auto'
+        self.rounds = []                # the Round of the pre-pass, if it is done
+
+        self.setHeaders(len(primary), len(secondary))
+        self.readRows(matrix)
+
+    def _recorder(self, level, choice):
+
+        # Record solution. Not to be called outside class
+
+        ROW = self.ROW
+        self.solutions.append([ROW[choice[idx]] for idx in range(0, level+1)])
+
+    def setHeaders(self, nPrimary, nSecondary):
+        """Sets up the root and column header slots.  As in Dancer, the primary headers
+        form a doubly-linked list through the root, and the secondary headers point to
+        themselves."""
+
+        size = 1 + nPrimary + nSecondary
+        self.L = L = [slot - 1 for slot in range(size)]
+        self.R = R = [slot + 1 for slot in range(size)]
+        self.U = list(range(size))
+        self.D = list(range(size))
+        self.C = list(range(size))
+        self.ROW = [-1] * size
+        self.S = [0] * size
+        self.seconded = [False] * size      # header temporarily made secondary?
+        L[0] = nPrimary
+        R[nPrimary] = 0
+        for slot in range(1 + nPrimary, size):
+            L[slot] = R[slot] = slot
+
+    def readRows(self, matrix):
+        """Initialize the membership matrix.
+
+        The input is the same as for Dancer.readRows: each row lists the names of the
+        columns with a 1 in this row, followed by a symbolic name for the row."""
+
+        L, R, U, D, C, ROW, S = self.L, self.R, self.U, self.D, self.C, self.ROW, self.S
+        index = self.index
+        rows = self.rows
+        rowStart = self.rowStart
+
+        for row in matrix:
+            rowNum = len(rows)
+            rows.append(row[-1])
+            first = len(C)
+            rowStart.append(first)
+            for col in row[:-1]:
+                c = index[col]
+                k = len(C)
+
+                # hook the new node in at the bottom of column c
+
+                C.append(c)
+                ROW.append(rowNum)
+                U.append(U[c])
+                D.append(c)
+                D[U[c]] = k
+                U[c] = k
+                L.append(k - 1)
+                R.append(k + 1)         # wrong for the last 1 in the row
+                S[c] += 1
+
+            # hook first and last 1s in row together
+
+            last = len(C) - 1
+            L[first] = last
+            R[last] = first
+
+    def backTrack(self, findAll):
+        # The main routine.  This is Dancer.backTrack with slots in place of Nodes.
+
+        # Returns the number of solutions found
+
+        L, R, D, C, S = self.L, self.R, self.D, self.C, self.S
+        cover   = self.cover
+        uncover = self.uncover
+        level   = 0                   # number of choices in current partial solution
+        choice  = [0] * len(S)        # the slots chosen at each level
+        count   = 0                   # number of solutions
+        state   = 'forward'
 
+        if R[0] == 0:
+            self.solutions.append([])   # nothing to cover: the empty solution
+            return 1
+
+        while True:
+
+            # forward:
+
+            if state == 'forward':
+                # Set best to best column for branching (one with fewest elements)
+                minLength = 10000000  # infinity
+                cur       = R[0]
+                while cur:
+                    if S[cur] < minLength:
+                        best      = cur
+                        minLength = S[cur]
+                    cur = R[cur]
+                cover(best)
+                currNode = choice[level] = D[best]
+
+            #advance:
+
+            if currNode == best:
+                state = 'backup'            # goto backup
+            else:
+
+                #cover all other columns of currNode
+
+                pp = R[currNode]
+                while pp != currNode:
+                    cover(C[pp])
+                    pp = R[pp]
+                if R[0] == 0:
+
+                    # record solution
+
+                    self._recorder(level, choice)
+                    count += 1
+
+                    if findAll:
+                        state = 'recover'   # goto recover
+                    else:
+                        break               # done
+                else:
+                    level += 1
+                    state = 'forward'
+                    continue                # goto forward
+
+            #backup:
+
+            if state == 'backup':
+                uncover(best)
+                if level == 0:
+                    break                   # done
+                level   -= 1
+                currNode = choice[level]
+                best     = C[currNode]
+
+            #recover:  ( backup falls through to here )
+
+            if state in ('backup', 'recover'):
+
+                # uncover all other columns of currNode, in LIFO order
+
+                pp = L[currNode]
+                while pp != currNode:
+                    uncover(C[pp])
+                    pp = L[pp]
+                currNode = choice[level] = D[currNode]
+                state    = 'advance'               # goto advance
+        return count
+
+    def cover(self, col):
+        # Same as Dancer.cover
+
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        updates = 1
+        L[R[col]] = L[col]                     # remove col from the headers list
+        R[L[col]] = R[col]
+        rr = D[col]
+        while rr != col:
+            nn = R[rr]
+            while nn != rr:
+                U[D[nn]] = U[nn]
+                D[U[nn]] = D[nn]                # remove node from the column
+                S[C[nn]] -= 1
+                updates += 1
+                nn = R[nn]
+            rr = D[rr]
+        self.updates += updates
+
+    def uncover(self, col):
+        # Same as Dancer.uncover
+
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        rr = U[col]
+        while rr != col:
+            nn = L[rr]
+            while nn != rr:
+                U[D[nn]] = D[U[nn]] = nn
+                S[C[nn]] += 1
+                nn = L[nn]
+            rr = U[rr]
+        R[L[col]] = L[R[col]] = col            # put col back into headers list
+
+    def _second(self, col, seconded):
+        # Remove header col from the headers list, remembering where it was
+
+        L, R = self.L, self.R
+        if not self.seconded[col]:
+            left  = L[col]
+            right = R[col]
+            R[left]  = right
+            L[right] = left
+            L[col] = R[col] = col
+            self.seconded[col] = True
+            seconded.append((col, left, right))
+            return 1
+        return 0
+
+    def cover2(self, col):
+        # Same as Dancer.cover2
+
+        R, U, D, C, ROW = self.R, self.U, self.D, self.C, self.ROW
+        seconded = self.secondedList
+        blocked  = self.blocked
+        updates  = self._second(col, seconded)
+        rr = D[col]
+        while rr != col:
+            blocked.append(ROW[rr])
+            nn = R[rr]
+            while nn != rr:
+                U[D[nn]] = U[nn]
+                D[U[nn]] = D[nn]                # remove node from its column
+                self._second(C[nn], seconded)   # temporarily make the column secondary
+                updates += 1
+                nn = R[nn]
+            rr = D[rr]
+        self.updates += updates
+
+    def uncover2(self, col):
+        # Same as Dancer.uncover2
+
+        L, U, D = self.L, self.U, self.D
+        rr = U[col]
+        while rr != col:
+            nn = L[rr]
+            while nn != rr:
+                U[D[nn]] = D[U[nn]] = nn
+                nn = L[nn]
+            rr = U[rr]
+
+    def unsecond(self):
+        L, R = self.L, self.R
+        for col, left, right in reversed(self.secondedList):
+            self.seconded[col] = False
+            L[col] = left
+            R[col] = right
+            R[left] = L[right] = col
+
+    def report(self):
+
+        # Print report.  Intended to be called by class user.
+
+        return [[self.rows[r] for r in s] for s in self.solutions]
+
+    def _planPrefilter(self, patterns):
+        # Dancer._planPrefilter, on the arrays: choose the bound, for bound = 'auto',
+        # and return whether to do the pre-pass.
+
+        S, D, ROW = self.S, self.D, self.ROW
+        index = self.index
+        lengths = sorted(S[1:1 + self.nPrimary])
+        median  = lengths[len(lengths) // 2]
+        candidates = [col for col in self.columns if S[index[col]] > 2 * median and
+                      [pattern for pattern in patterns if pattern.match(col)]]
+        candidates.sort(key = lambda col: -S[index[col]])
+        longCols = candidates[:Dancer.planColumns]
+
+        excluded = 0
+        blocked = set()
+        for col in longCols:
+            c = index[col]
+            rr = D[c]
+            while rr != c:
+                if ROW[rr] not in blocked:
+                    blocked.add(ROW[rr])
+                    excluded += self.rowLength(ROW[rr])
+                rr = D[rr]
+        total = sum(S[1:])
+
+        if longCols and excluded > Dancer.planShare * total:
+            self.bound = S[index[longCols[-1]]] - 1
+            self.plan = Plan(True, self.bound, longCols, excluded, total)
+            return True
+        self.bound = max(S[1:])
+        self.plan = Plan(False, self.bound, longCols, excluded, total)
+        return False
+
+    def rowLength(self, row):
+        # The number of 1's in row
+
+        R = self.R
+        first = nn = self.rowStart[row]
+        length = 0
+        while True:
+            length += 1
+            nn = R[nn]
+            if nn == first:
+                return length
+
+    def solve(self, findAll = True):
+        # Same as Dancer.solve, including the iterated dancing links pre-pass, in a
+        # single pass.  As in Dancer, pattern may be a list of patterns.
+
+        S = self.S
+        index = self.index
+        longCols = []
+        if self.pattern is not None:
+            patterns = self.pattern
+            if not isinstance(patterns, (list, tuple)):
+                patterns = [patterns]
+            if self.bound != 'auto' or self._planPrefilter(patterns):
+                bound = self.bound
+                longCols = [index[col] for col in self.columns if S[index[col]] > bound and
+                            [pattern for pattern in patterns if pattern.match(col)]]
+        if longCols:
+            updates = self.updates
+            self.secondedList = []
+            self.blocked  = []
+
+            for col in longCols:
+                self.cover2(col)    # computes self.secondedList and self.blocked
+
+            # Every partial solution is needed, as in Dancer, even if only one
+            # solution is wanted: the rows not in any of them are deleted.
+
+            self.backTrack(True)
+            goodRows = set(row for s in self.solutions for row in s)
+            blocked  = set(self.blocked)
+
+            # put the matrix back in its original condition
+
+            for col in reversed(longCols):
+                self.uncover2(col)
+            self.unsecond()
+
+            # delete useless rows
+
+            deleted = nodes = 0
+            for row in range(len(self.rows)):
+                if row not in goodRows and row not in blocked:
+                    nodes += self.rowLength(row)
+                    deleted += 1
+                    self.deleteRow(row)
+            self.rounds.append(Round(1, 0, len(longCols), deleted, nodes, self.updates - updates))
+
+            self.solutions = []        # erase the partial solutions
+
+        self.backTrack(findAll)
+        return self.updates
+
+    def deleteRow(self, row):
+        R, U, D, C, S = self.R, self.U, self.D, self.C, self.S
+        first = nn = self.rowStart[row]
+        updates = 0
+        while True:
+            D[U[nn]] = D[nn]
+            U[D[nn]] = U[nn]                  # remove node from the column
+            S[C[nn]] -= 1
+            nn = R[nn]
+            if nn == first:
+                break
+            updates += .5                     # this update won't be undone
+        self.updates += int(updates + 1.1)
+
+    def printColumn(self, col):
+        rows = self.rows
+        c = self.index[col]
+
+        print "%s: length %d " % (col, self.S[c])
+        rr = self.D[c]
+        while rr != c:
+            row = rows[self.ROW[rr]]
+            print "    %s" % (row,)
+            rr = self.D[rr]
+
+    def printHeaders(self):
+        R = self.R
+        c = R[0]
+        while c:
+            self.printColumn(self.columns[c-1])
+            c = R[c]
+        print
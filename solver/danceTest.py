@@ -0,0 +1,79 @@
+"""Tests of the exact cover solvers and the column strategies.  Run with
+python -m unittest danceTest from this directory."""
+
+import time, unittest
+
+import dance4, strategies
+
+class StrategyTest(unittest.TestCase):
+
+    # Column 0 is the only shortest column, so it is the first one chosen
+
+    primary = [0, 1, 2]
+    matrix = [[0, 1, 'a'], [1, 'b'], [2, 'c'], [1, 2, 'd'], [2, 'e']]
+
+    def testColumnZero(self):
+        for name in sorted(strategies.byName):
+            dlx = dance4.Dancer(self.primary, self.matrix, strategy = name)
+            dlx.solve()
+            self.assertEqual(sorted([sorted(s) for s in dlx.report()]),
+                             [['a', 'c'], ['a', 'e']], name)
+
+    def testDeadEnd(self):
+        # Column 2 is empty, so Weighted must choose it over column 0, of length 1,
+        # and the search stops there
+
+        primary = [0, 1, 2]
+        matrix = [[0, 1, 'a'], [1, 'b']]
+        dlx = dance4.Dancer(primary, matrix, strategy = strategies.Weighted())
+        self.assertEqual(dlx._bestColumn(), 2)
+
+    def testCompare(self):
+        # A seeded RandomTies is started afresh on each problem, so the same problem,
+        # a 4 by 4 latin square, costs the same each time
+
+        cells = [(n, x, y) for n in range(4) for x in range(4) for y in range(4)]
+        matrix = [[('R', n, y), ('C', n, x), ('P', x, y), (n, x, y)] for n, x, y in cells]
+        primary = sorted(set([col for row in matrix for col in row[:-1]]))
+        problems = [(primary, matrix)] * 3
+        once = strategies.compare(problems[:1], {'r': strategies.RandomTies(1)})['r']
+        thrice = strategies.compare(problems, {'r': strategies.RandomTies(1)})['r']
+        self.assertEqual(thrice[:2], (3 * once[0], 3 * once[1]))
+
+class LimitTest(unittest.TestCase):
+
+    # A search that would find its solution at once stops before it starts
+
+    primary = [0, 1]
+    matrix = [[0, 'a'], [1, 'b'], [0, 1, 'c']]
+
+    def testCancelled(self):
+        cancel = dance4.CancelToken()
+        cancel.set()
+        dlx = dance4.Dancer(self.primary, self.matrix)
+        dlx.solve(cancel = cancel)
+        self.assertFalse(dlx.result.complete)
+        self.assertEqual(dlx.result.reason, 'cancelled')
+        self.assertEqual(dlx.report(), [])
+
+    def testDeadline(self):
+        dlx = dance4.Dancer(self.primary, self.matrix)
+        dlx.solve(deadline = time.time() - 1)
+        self.assertFalse(dlx.result.complete)
+        self.assertEqual(dlx.result.reason, 'deadline')
+        self.assertEqual(dlx.report(), [])
+
+    def testMaxUpdates(self):
+        dlx = dance4.Dancer(self.primary, self.matrix)
+        dlx.solve(max_updates = 1)
+        self.assertFalse(dlx.result.complete)
+        self.assertEqual(dlx.result.reason, 'max_updates')
+
+    def testComplete(self):
+        dlx = dance4.Dancer(self.primary, self.matrix)
+        dlx.solve(deadline = time.time() + 60, cancel = dance4.CancelToken())
+        self.assertTrue(dlx.result.complete)
+        self.assertEqual(len(dlx.report()), 2)
+
+if __name__ == '__main__':
+    unittest.main()
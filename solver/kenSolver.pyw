@@ -9,10 +9,16 @@ from Tkinter import *
 from tkMessageBox import *                    # get standard dialogs
 from tkFileDialog import *
 import threading, time
-from dance4 import Dancer                     # DLX
-import time, re
+from dance4 import Dancer, ArrayDancer        # DLX
+from dance4 import CancelToken, Lazy
+from bitDance import BitDancer                # Algorithm X on bit sets
+from npDance import NumpyDancer               # Algorithm X on a NumPy bit matrix
+import time, re, sys
 from scrolledText import ScrolledText
 import os.path
+import tileTable
+from math import factorial
+from collections import OrderedDict
 
 NONE = ' '
 ADD = '+'
@@ -21,38 +27,220 @@ SUB = u'\u2212'  # not recognized by canvas.postscript: rendered as "?"
 MUL =u'\xd7'
 DIV = '/'
 
+# exact cover engines, selectable in KenKen.solve; all take the same input
+
+engines = {'dlx': Dancer, 'array': ArrayDancer, 'bits': BitDancer, 'numpy': NumpyDancer}
+
+# the table of precomputed tilings made by buildTileTable, if it has been built
+
+tilePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tiles.dat')
+
+class Layout(object):
+    # The numbering of the columns of the exact cover matrix for a dim-by-dim puzzle.
+    # The constraint "n in row y" is column (n-1)*dim + y, "n in column x" is column
+    # dim*dim + (n-1)*dim + x, and "tile cage c" is column 2*dim*dim + c.  The columns
+    # are small integers, which are cheaper to hash than strings; names like 3R5, 3C2
+    # and C14 are only made by name() when they are to be shown.
+
+    # The layout for the colored encoding (see TiledCage.encodeLinked) has no cage
+    # columns.  Instead "cell (x, y) is filled" is primary column 2*dim*dim + y*dim + x,
+    # and the link between cells j and j+1 of cage c is secondary column
+    # 3*dim*dim + c*dim*dim + j.  Their names are like P2,5 and L14.0.
+
+    def __init__(self, dim, colored = False):
+        self.dim = dim
+        self.colored = colored
+        self.cageBase = 2 * dim * dim
+        self.cellBase = 2 * dim * dim
+        self.linkBase = 3 * dim * dim
+
+        # The latin square columns in the order the names sort in, so the search is
+        # the same as it was with names: for each n, its columns and then its rows.
+
+        self.latin = [col for n in range(1, dim+1) for col in
+                      [dim*dim + (n-1)*dim + x for x in range(dim)] + [(n-1)*dim + y for y in range(dim)]]
+
+    def inRow(self, n, y):
+        return (n-1)*self.dim + y
+
+    def inColumn(self, n, x):
+        return self.dim*self.dim + (n-1)*self.dim + x
+
+    def cage(self, c):
+        return self.cageBase + c
+
+    def cell(self, x, y):
+        return self.cellBase + y*self.dim + x
+
+    def link(self, c, j):
+        return self.linkBase + c*self.dim*self.dim + j
+
+    def primary(self, idents):
+        # The primary columns for a puzzle whose cages have IDs idents
+        if self.colored:
+            return self.latin + range(self.cellBase, self.linkBase)
+        return self.latin + [self.cageBase + c for c in sorted(idents)]
+
+    def secondary(self, cages):
+        # The secondary columns for the dict of tiled cages, by ID: their links
+        if not self.colored:
+            return []
+        return [self.link(c, j) for c in sorted(cages) for j in range(len(cages[c].cage) - 1)]
+
+    def match(self, col):
+        # Is col a cage column?  A Layout serves as the pattern of the cage columns
+        # for the iterated dancing links pre-pass.
+        return col >= self.cageBase and not self.colored
+
+    def classify(self, col):
+        # The kind of column, for strategies.Weighted: 'nR' for "n in row y", 'nC' for
+        # "n in column x", 'C' for a cage, 'P' for a cell and 'L' for a link, the
+        # classes strategies.columnClass gives their names.
+
+        if col < self.dim * self.dim:
+            return 'nR'
+        if col < self.cageBase:
+            return 'nC'
+        if not self.colored:
+            return 'C'
+        if col < self.linkBase:
+            return 'P'
+        return 'L'
+
+    def name(self, col):
+        dim = self.dim
+        if self.colored and col >= self.linkBase:
+            return 'L%d.%d' % divmod(col - self.linkBase, dim*dim)
+        if self.colored and col >= self.cellBase:
+            y, x = divmod(col - self.cellBase, dim)
+            return 'P%d,%d' % (x, y)
+        if col >= self.cageBase:
+            return 'C%d' % (col - self.cageBase)
+        if col >= dim*dim:
+            n, x = divmod(col - dim*dim, dim)
+            return '%dC%d' % (n + 1, x)
+        n, y = divmod(col, dim)
+        return '%dR%d' % (n + 1, y)
+
+    layouts = {}        # (dim, colored) -> Layout, since it is the same for every puzzle of that size
+
+    @classmethod
+    def get(cls, dim, colored = False):
+        if (dim, colored) not in cls.layouts:
+            cls.layouts[dim, colored] = Layout(dim, colored)
+        return cls.layouts[dim, colored]
+
+class Factors(object):
+    # The digits from 1 to dim by their prime factors, for the products of MUL cages.
+    # exponents[n] is a dict of the exponents of the primes in n, and most[p] is the
+    # largest exponent of p in any digit.  A value is the product of num digits only
+    # if each of its primes is at most dim, and appears at most num * most[p] times.
+    # The divisors and the answers of reachable are saved, since the same values come
+    # up again and again as a product is divided by its digits.
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.primes = [p for p in range(2, dim+1) if not [q for q in range(2, p) if p % q == 0]]
+        self.exponents = [None] + [self.factor(n) for n in range(1, dim+1)]
+        self.most = dict([(p, max([e.get(p, 0) for e in self.exponents[1:]])) for p in self.primes])
+        self.divisorTable = {}
+        self.reachTable = {}
+
+    def factor(self, value):
+        # The exponents of the primes in value, or None if it has a prime bigger than dim
+        answer = {}
+        for p in self.primes:
+            while value % p == 0:
+                value //= p
+                answer[p] = answer.get(p, 0) + 1
+        if value != 1:
+            return None
+        return answer
+
+    def divisors(self, value):
+        # The digits that divide value, in increasing order
+        if value not in self.divisorTable:
+            self.divisorTable[value] = [n for n in range(1, self.dim+1) if value % n == 0]
+        return self.divisorTable[value]
+
+    def reachable(self, value, num):
+        # Can value be the product of num digits?
+        if (value, num) not in self.reachTable:
+            exponents = self.factor(value)
+            self.reachTable[value, num] = exponents is not None and value <= self.dim ** num and \
+                not [p for p in exponents if exponents[p] > num * self.most[p]]
+        return self.reachTable[value, num]
+
+    tables = {}         # dim -> Factors
+
+    @classmethod
+    def get(cls, dim):
+        if dim not in cls.tables:
+            cls.tables[dim] = Factors(dim)
+        return cls.tables[dim]
+
 clueFont = ('helevetica', 12, 'bold')
 solutionFont = ('heletica', 20, 'bold')
 
-def multiSum(value, num, limit):
-    # a list of all lists of num integers from 1 to limit (repetitions allowed),  whose sum is value
+def colineal(cells):
+    # For each cell, the indices of the cells before it in the same row or column
+
+    return [[j for j in range(k) if cells[j][0] == cells[k][0] or cells[j][1] == cells[k][1]]
+            for k in range(len(cells))]
+
+def sumTilings(value, colineal, limit):
+    # All tuples of len(colineal) integers from 1 to limit whose sum is value, with no
+    # number repeated in a row or column: colineal[k] lists the cells before cell k
+    # in its row or column.  Each cell only takes the numbers that leave a sum the
+    # cells after it can make, so no prefix is a dead end for the sum.
+
+    last = len(colineal) - 1
+    tile = []
+
+    def fill(k, left):
+        # the tilings that extend tile, which fills cells 0 to k-1, with sum left for the rest
+        more = last - k
+        for n in range(max(1, left - more*limit), min(limit, left - more) + 1):
+            if [j for j in colineal[k] if tile[j] == n]:
+                continue                # number repeated in row or column
+            tile.append(n)
+            if more:
+                for found in fill(k + 1, left - n):
+                    yield found
+            else:
+                yield tuple(tile)
+            tile.pop()
 
-    if num == 1:
-        if 1 <= value <= limit:
-            yield [value]
-        else:
-            yield None
-    else:
-        for n in range(1, limit+1):
-            for m in multiSum(value-n, num-1, limit):
-                if m is not None:
-                    yield m + [n]
-
-def multiProduct(value, num, limit):
-    # a list of all lists of num integers from 1 to limit (repetitions allowed),  whose product is value
-
-    if num == 1:
-        if 1 <= value <= limit:
-            yield [value]
-        else:
-            yield None
-    else:
-        for n in range(1, limit+1):
-            if value % n != 0:
+    return fill(0, value)
+
+def productTilings(value, colineal, limit):
+    # All tuples of len(colineal) integers from 1 to limit whose product is value, with
+    # no number repeated in a row or column, as in sumTilings.  Each cell only takes
+    # the divisors that leave a product the cells after it can make.
+
+    factors = Factors.get(limit)
+    last = len(colineal) - 1
+    tile = []
+
+    def fill(k, left):
+        # the tilings that extend tile, which fills cells 0 to k-1, with product left for the rest
+        more = last - k
+        for n in factors.divisors(left):
+            if (more and not factors.reachable(left // n, more)) or (not more and n != left):
                 continue
-            for m in multiProduct(value // n, num-1, limit):
-                if m is not None:
-                    yield m + [n]
+            if [j for j in colineal[k] if tile[j] == n]:
+                continue                # number repeated in row or column
+            tile.append(n)
+            if more:
+                for found in fill(k + 1, left // n):
+                    yield found
+            else:
+                yield tuple(tile)
+            tile.pop()
+
+    if not factors.reachable(value, len(colineal)):
+        return iter([])
+    return fill(0, value)
 
 class CageError(Exception):
     def __init__(self, *args):
@@ -121,10 +309,8 @@ class Cage(list):
     # Is it possible to fill in the cage with numbers  with the given total?
     # If we can find DISTINCT number with the given total, then there
     # is no problem,, since there can't be repetitions.
-    # If not, we find all  mutisums with the given total.  Implicitly, these
-    # are in the same order as the cage cells to which they are assigned,
-    # so we just work with indices.
-    # We generate a multisum and test for lack of repetitions.
+    # If not, we look for a tiling with the given total, which sumTilings
+    # makes without repetitions.
     # Return True on first success, otherwise return False.
 
         lower = sum(range(1, 1+len(cage)))
@@ -133,46 +319,20 @@ class Cage(list):
         if len(cage) <= dim and lower <= total<= upper:
             return True
 
-        adjacent = {}
-        for c in cage:
-            adjacent[cage.index(c)] = [cage.index(x) for x in cage if x != c and (x[0] == c[0] or x[1] == c[1])]
-
-        for x in multiSum(total, len(cage), dim):
-            for k in range(len(x)):
-                if x[k] in [x[j] for j in adjacent[k]]:
-                    break                   # number repeated in row or column
-            else:
-                return True               # loop else -- no repetitions
+        for tile in sumTilings(total, colineal(cage), dim):
+            return True
         return False
 
     def validateProduct(self, cage, product, dim):
         # Is it possible to fill in the cage with numbers  with the given product?
 
-        # We find all  mutiproducts with the given product.  Implicitly, these
-        # are in the same order as the cage cells to which they are assigned,
-        # so we just work with indices.
-        # We generate a multiproduct and test for lack of repetitions.
+        # We look for a tiling with the given product, which productTilings
+        # makes without repetitions.  It gives up at once if the product has
+        # a prime bigger than dim, or too many of a prime for the cage.
         # Return True on first success, otherwise return False.
 
-        primes = [ p for p in [2, 3, 5, 7, 11, 13, 17, 19] if p <= dim]
-
-        val = product
-        for p in primes:
-            while val % p == 0:
-                val //= p
-        if val != 1:
-            return False   # product cannot be factored into primes <= dim
-
-        adjacent = {}
-        for c in cage:
-            adjacent[cage.index(c)] = [cage.index(x) for x in cage if x != c and (x[0] == c[0] or x[1] == c[1])]
-
-        for x in multiProduct(product, len(cage), dim):
-            for k in range(len(x)):
-                if x[k] in [x[j] for j in adjacent[k]]:
-                    break                   # number repeated in row or column
-            else:
-                return True               # loop else -- no repetitions
+        for tile in productTilings(product, colineal(cage), dim):
+            return True
         return False
 
     def __str__(self):
@@ -183,112 +343,439 @@ class Cage(list):
         answer = answer + ']'
         return answer
 
+class TilingCache(object):
+    # The tilings of cages, kept for the cages to come.  The tilings depend only on
+    # the operation, the value, dim, and which cells share a row or column, so a cage
+    # of the same shape anywhere on the board, turned or reflected, has the same ones.
+    # canonical() numbers the cells of a cage in the order whose colineal lists are
+    # least, of the orders by row and column of the eight ways to turn the board; the
+    # tilings are kept in that order.  At most size of them are kept, and the one used
+    # least recently is dropped first.  hits and misses count the lookups.
+
+    symmetries = [(sx, sy, swap) for sx in (1, -1) for sy in (1, -1) for swap in (False, True)]
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()        # key -> tilings, the most recently used last
+        self.hits = 0
+        self.misses = 0
+        self.mutex = threading.Lock()       # the tile threads share the cache
+
+    def arrange(self, cells):
+        # The least colineal lists of the cells, and the order of the cells they are for
+
+        best = None
+        for sx, sy, swap in self.symmetries:
+            turned = [(sy*y, sx*x) if swap else (sx*x, sy*y) for x, y in cells]
+            order = sorted(range(len(cells)), key = lambda k: (turned[k][1], turned[k][0]))
+            pattern = tuple([tuple(c) for c in colineal([cells[k] for k in order])])
+            if best is None or pattern < best[0]:
+                best = (pattern, order)
+        return best
+
+    def canonical(self, cage, dim):
+        # The key of the cage, and the order of its cells: cell order[i] of the cage is
+        # cell i in the tilings kept
+
+        pattern, order = self.arrange(cage)
+        return (cage.op, cage.value, dim, pattern), order
+
+    def label(self, key):
+        # key as a string, for the tile table: like A17:9:/0/01 for an ADD 17 cage of
+        # three cells in a row on a 9-by-9 board
+
+        op, value, dim, pattern = key
+        letter = {NONE: 'N', ADD: 'A', SUB: 'S', MUL: 'M', DIV: 'D'}[op]
+        return '%s%d:%d:%s' % (letter, value, dim, '/'.join([''.join(map(str, c)) for c in pattern]))
+
+    def get(self, key):
+        # The tilings for key, or None if they are not kept
+        self.mutex.acquire()
+        tiles = self.entries.pop(key, None)
+        if tiles is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries[key] = tiles
+        self.mutex.release()
+        return tiles
+
+    def put(self, key, tiles):
+        self.mutex.acquire()
+        self.entries[key] = tiles
+        while len(self.entries) > self.size:
+            self.entries.popitem(last = False)
+        self.mutex.release()
+
 class TiledCage(object):
     # The cage is represented as a list of cell coordinates (x,y).
     # The tiles represent all ways of "tiling" the cells with numbers.
     # Each tile will generate one row in the dancing links matrix.
     # Assignment of number n to cell (x, y) generates two ones in the matrix,
-    # with symbolic names 'nCx' (n in column x) and 'nRy'  (n in row y)
+    # in the columns for 'nCx' (n in column x) and 'nRy'  (n in row y)
     # Each cage has a unique id c.  The column Cc (cage c) is a member of each tile,
-    # since the cage must be tiled exactly once.
+    # since the cage must be tiled exactly once.  The columns are numbered by Layout.
 
-    # A tiling is represented as a list of numbers, in the same order as the cells
+    # A tiling is represented as a tuple of numbers, in the same order as the cells
     # they tile are listed in self.cage.  The corresponding row is a sorted list of
-    # column names.
+    # column numbers.
+
+    # Most tilings of a big cage are reorderings of a few multisets of digits, so
+    # the tilings are not kept.  self.multisets is the list of the multisets, as
+    # sorted tuples, that make the sum or product; placements() orders a multiset
+    # in the cage, and tilings() runs through all of them.  Only the rows, in
+    # self.code, are kept, each named by its tiling.  Tilings found for one cage are
+    # kept in the class's cache for the cages of the same shape.  Before they are
+    # found, they are looked up in the tile table, if there is one.
 
-    def __init__(self, cage, dim, id):
+    # If lazy, the rows are not made here, but by lazyRows, during the search,
+    # and only those that fit the digits already placed; self.code is empty.
+    # See lazyColumn.
+
+    def __init__(self, cage, dim, id, lazy = False):
         # Precondition: All parameters are valid.  There is at least one legal tiling.
 
         self.cage = cage
-        op = cage.op
-        value = cage.value
+        self.id = id
+        self.dim = dim
+        self.lazy = lazy
+        self.colineal = colineal(cage)
+        self.multisets = self.findMultisets(cage.op, cage.value, dim)
         #self.rows = []
-        if op == NONE:
-            self.tiles = self.tileNone(value)
-        elif op == ADD:
-            self.tiles = self.tileAdd(value, dim)
-        elif op == SUB:
-            self.tiles = self.tileSub(value, dim)
-        elif op == MUL:
-            self.tiles = self.tileMul(value, dim)
-        elif op == DIV:
-            self.tiles = self.tileDiv(value, dim)
-        self.code = self.encode(id)
-
-    def tileNone(self, value):
-        return [[value]]
-
-    def tileSub(self, value, dim):
-        answer = []
-        for n in range(value+1, dim+1):
-            if 1 <= n - value <= dim:
-                answer += [[n, n - value], [n-value, n]]
-        return answer
-
-    def tileDiv(self, value, dim):
-        answer = []
-        for n in range(value, dim+1):
-            if n % value == 0:
-                answer += [[n, n // value], [n//value, n]]
-        return answer
-
-    def tileAdd(self, value, dim):
-        cage = self.cage
-        colineal = {}
-        for c in cage:
-            colineal[cage.index(c)] = [cage.index(x) for x in cage if x != c and (x[0] == c[0] or x[1] == c[1])]
-
-        answer = []
-        for x in multiSum(value, len(cage), dim):
-            for k in range(len(x)):
-                if x[k] in [x[j] for j in colineal[k]]:
-                    break                   # number repeated in row or column
-            else:                             # normal exit means valid tiling
-                answer.append(x)
-        return answer
+        if lazy:
+            self.code = []
+            return
+        self.code = self.encode(id, dim)
 
-    def tileMul(self, value, dim):
-        cage = self.cage
-        colineal = {}
-        for c in cage:
-            colineal[cage.index(c)] = [cage.index(x) for x in cage if x != c and (x[0] == c[0] or x[1] == c[1])]
+    def findMultisets(self, op, value, dim):
+        # The multisets of len(self.cage) digits from 1 to dim with the value, made
+        # in increasing order, so that each comes once
 
+        num = len(self.cage)
+        if op == NONE:
+            return [(value,)]
+        if op == SUB:
+            return [(n - value, n) for n in range(value+1, dim+1)]
+        if op == DIV:
+            return [(n // value, n) for n in range(value, dim+1) if n % value == 0]
+        factors = Factors.get(dim)
         answer = []
-        for x in multiProduct(value, len(cage), dim):
-            for k in range(len(x)):
-                if x[k] in [x[j] for j in colineal[k]]:
-                    break                   # number repeated in row or column
-            else:                             # normal exit means valid tiling
-                answer.append(x)
+        partial = []
+
+        def extend(least, left):
+            # add the digits, all at least least, to make up left
+            more = num - len(partial)
+            if more == 1:
+                if least <= left <= dim:
+                    answer.append(tuple(partial + [left]))
+                return
+            if op == ADD:
+                for n in range(least, dim+1):
+                    if n * more > left:
+                        break
+                    if left - n <= (more - 1) * dim:
+                        partial.append(n)
+                        extend(n, left - n)
+                        partial.pop()
+            else:
+                for n in factors.divisors(left):
+                    if n ** more > left:
+                        break
+                    if n >= least and factors.reachable(left // n, more - 1):
+                        partial.append(n)
+                        extend(n, left // n)
+                        partial.pop()
+
+        extend(1, value)
         return answer
 
-    def encode(self, id):
+    def placements(self, digits, allowed = None):
+        # The tilings that put the multiset digits in the cage, each ordering once,
+        # with no number repeated in a row or column.  If allowed is given, digit n
+        # can go in cell k only if n is in allowed[k].
+
+        colineal = self.colineal
+        last = len(self.cage) - 1
+        left = {}
+        for n in digits:
+            left[n] = left.get(n, 0) + 1
+        choices = sorted(left)
+        tile = []
+
+        def fill(k):
+            # the tilings that extend tile, which fills cells 0 to k-1
+            for n in choices:
+                if not left[n] or (allowed and n not in allowed[k]):
+                    continue
+                if [j for j in colineal[k] if tile[j] == n]:
+                    continue                # number repeated in row or column
+                tile.append(n)
+                left[n] -= 1
+                if k < last:
+                    for found in fill(k + 1):
+                        yield found
+                else:
+                    yield tuple(tile)
+                left[n] += 1
+                tile.pop()
+
+        return fill(0)
+
+    cache = TilingCache(500)
+    table = tileTable.load(tilePath)
+
+    def tilings(self):
+        # A list of all the tilings of the cage.  If the cache does not have them, they
+        # are found a multiset at a time.  Otherwise they are put in the order of
+        # the cells of this cage.
+
+        key, order = self.cache.canonical(self.cage, self.dim)
+        kept = self.cache.get(key)
+        if kept is None and self.table is not None:
+            kept = self.table.lookup(self.cache.label(key))
+            if kept is not None:
+                self.cache.put(key, kept)
+        if kept is None:
+            tiles = [tile for digits in self.multisets for tile in self.placements(digits)]
+            self.cache.put(key, [tuple([tile[k] for k in order]) for tile in tiles])
+            return tiles
+        if order == sorted(order):
+            return kept
+        where = [order.index(k) for k in range(len(order))]
+        return [tuple([tile[i] for i in where]) for tile in kept]
+
+    def encode(self, id, dim):
 
         # Each tiling is a list of columns IDS, indicating what constraints the tiling statisfies.
         # The constraints are either primary (meaning that they must be satisifed exactly once) or
         # secondary, meaning that they can be satisfied at most once.)  This is in accordance
-        # with Knuth's DLX terminology.  There are no secondary constraints in kenken.
+        # with Knuth's DLX terminology.  There are no secondary constraints in this encoding.
         # Primary constraints are either of the form, "n in row r", or "n in column c", or "tile cage id".
-        # The last element of each list is an encoding of the tiling.  The remaining elements are
-        # sorted alphabetically.  The encoding is simply a catenation of strings of the form "%d%d%d" %(n,x,y)
-        # meaning that digit n is placed in column x, row y.
+        # The last element of each list names the tiling: it is (id, tile).  The
+        # remaining elements are the column numbers, sorted.  cells() turns the tile
+        # back into the numbers and the cells they go in.
 
-        cageCol = 'C' + str(id)
+        layout = Layout.get(dim)
+        cageCol = layout.cage(id)
+        base = dim * dim
         cage = self.cage
-        tiles = self.tiles
         answer = []
-        for tile in tiles:
-            name = ''
+        for tile in self.tilings():
             row = [cageCol]
             for n, (x,y) in zip(tile, cage):
-                row += [str(n) + 'C' + str(x)]
-                row += [str(n) + 'R' + str(y)]
-                name = name + "%d%d%d" %(n,x,y)
+                row.append((n-1)*dim + y)              # layout.inRow(n, y)
+                row.append(base + (n-1)*dim + x)       # layout.inColumn(n, x)
             row.sort()
-            row += [name]
-            answer += [row]
+            row.append((id, tile))
+            answer.append(row)
         return answer
 
+    def cells(self, tile):
+        # The tiling as a list of (n, x, y): digit n goes in cell (x, y).
+
+        return [(n, x, y) for n, (x, y) in zip(tile, self.cage)]
+
+    def lazyColumn(self):
+        # The Lazy for the cage column of a lazy cage.  Its rows may have the columns
+        # for the rows and columns of its cells of any digit in one of the multisets.
+        # The fewer they are, the sooner the search can branch on them.  Its estimate
+        # is the number of orderings of the multisets, which is more than the tilings
+        # but quick to count.
+
+        layout = Layout.get(self.dim)
+        digits = set([n for multiset in self.multisets for n in multiset])
+        support = set()
+        for x, y in self.cage:
+            for n in digits:
+                support.add(layout.inRow(n, y))
+                support.add(layout.inColumn(n, x))
+        estimate = 0
+        for multiset in self.multisets:
+            orders = factorial(len(multiset))
+            for n in set(multiset):
+                orders //= factorial(multiset.count(n))
+            estimate += orders
+        return Lazy(self.lazyRows, support, estimate)
+
+    def lazyRows(self, dancer):
+        # The rows of a lazy cage, as encode would make them, for the tilings that
+        # put no digit where the dancer has already covered that digit's row or column.
+        # A multiset is skipped unless each of its digits is still free in as many
+        # cells as it has copies; only then are its placements tried.
+
+        dim = self.dim
+        cage = self.cage
+        layout = Layout.get(dim)
+        covered = dancer.covered
+        cageCol = layout.cage(self.id)
+        allowed = [set([n for n in range(1, dim+1) if not covered(layout.inRow(n, y))
+                        and not covered(layout.inColumn(n, x))]) for x, y in cage]
+        free = {}                           # the number of cells each digit can go in
+        for digits in allowed:
+            for n in digits:
+                free[n] = free.get(n, 0) + 1
+
+        for multiset in self.multisets:
+            if [n for n in set(multiset) if free.get(n, 0) < multiset.count(n)]:
+                continue
+            for tile in self.placements(multiset, allowed):
+                row = [cageCol]
+                for n, (x, y) in zip(tile, cage):
+                    row.append(layout.inRow(n, y))
+                    row.append(layout.inColumn(n, x))
+                row.sort()
+                row.append((self.id, tile))
+                yield row
+
+    def encodeLinked(self):
+
+        # The rows for the colored encoding, which needs a Dancer.  Each row places
+        # digits in cells: it has the columns "n in row y" and "n in column x", and
+        # "cell (x, y) is filled", for each digit n it puts in cell (x, y).  The name
+        # of the row is the tuple of (n, x, y).
+
+        # A cage can be tiled with one row for each tiling, as in encode.  For a big
+        # cage it takes fewer rows to fill it a cell at a time, with one row for each
+        # digit n of cell j and each value v of the cells before it: the sum, for an
+        # ADD cage, or the product, for a MUL cage, or the first digit, for a cage of
+        # two cells.  The secondary column linking cells j and j+1 has the color
+        # v + n, or v * n, in the row, and the color v in the rows for cell j+1 that
+        # follow it.  The rows chosen for the cage must agree on the colors, so their
+        # digits make up one of the tilings.  Only values that some tiling reaches are
+        # used, and whichever takes fewer rows is chosen.
+
+        # When the rows of the tilings are chosen, they may be split by multiset, as
+        # compactRows does, if that takes fewer nodes.
+
+        id = self.id
+        dim = self.dim
+        layout = Layout.get(dim, colored = True)
+        cage = self.cage
+        last = len(cage) - 1
+        steps = set()               # (cell j, value before it, digit, value after it)
+        tiles = [row[-1][1] for row in self.code]
+        for tile in tiles:
+            before = None
+            for j, n in enumerate(tile):
+                if j == last:
+                    after = None
+                elif j == 0:
+                    after = n
+                elif cage.op == ADD:
+                    after = before + n
+                else:
+                    after = before * n
+                steps.add((j, before, n, after))
+                before = after
+
+        def place(n, x, y):
+            return [layout.inRow(n, y), layout.inColumn(n, x), layout.cell(x, y)]
+
+        answer = []
+        if len(steps) >= len(tiles):
+            for tile in tiles:
+                cells = self.cells(tile)
+                row = [col for n, x, y in cells for col in place(n, x, y)]
+                row.sort()
+                answer.append(row + [tuple(cells)])
+            if last > 0:
+                compact = self.compactRows(answer, tiles)
+                if sum([len(row) for row in compact]) < sum([len(row) for row in answer]):
+                    return compact
+            return answer
+        for j, before, n, after in sorted(steps):
+            x, y = cage[j]
+            row = sorted(place(n, x, y))
+            if j > 0:
+                row.append((layout.link(id, j-1), before))
+            if j < last:
+                row.append((layout.link(id, j), after))
+            answer.append(row + [((n, x, y),)])
+        return answer
+
+    def compactRows(self, rows, tiles):
+        # The rows of the colored encoding, one for each tiling, with the multiset
+        # of each tiling chosen first.  Each multiset has a row of the columns that
+        # all its placements have, which include the first cell's, with the multiset
+        # as the color of the link column of cells 0 and 1.  Each placement has a row
+        # of the rest of its columns, which always include the other cells' columns,
+        # with the same color.  The first cell's column makes the search choose one
+        # multiset row, and the other cells' columns one placement row, of the same
+        # multiset: the two together have the columns of the tiling.  The multiset
+        # row places no digits, so its name is ().
+
+        layout = Layout.get(self.dim, colored = True)
+        link = layout.link(self.id, 0)
+        others = set([layout.cell(x, y) for x, y in self.cage[1:]])
+        groups = {}                 # multiset -> the rows of its placements
+        order = []
+        for row, tile in zip(rows, tiles):
+            multiset = tuple(sorted(tile))
+            if multiset not in groups:
+                groups[multiset] = []
+                order.append(multiset)
+            groups[multiset].append(row)
+
+        answer = []
+        for multiset in order:
+            group = groups[multiset]
+            common = set(group[0][:-1]) - others
+            for row in group[1:]:
+                common.intersection_update(row[:-1])
+            answer.append(sorted(common) + [(link, multiset), ()])
+            for row in group:
+                answer.append([col for col in row[:-1] if col not in common] + [(link, multiset), row[-1]])
+        return answer
+
+def buildTileTable(path, maxCells, dims = range(3, 10)):
+    # Write the tile table of the tilings of every cage of up to maxCells cells, on
+    # boards of each size in dims.  The cages are the polyominoes that fit on the
+    # board, one for each way their cells share rows and columns, with each value
+    # the operations allow.
+
+    cache = TiledCage.cache
+    entries = {}
+    shapes = set([((0, 0),)])
+    for size in range(1, maxCells + 1):
+        if size > 1:
+            shapes = set([tuple(sorted(shape + (c,))) for shape in shapes for x, y in shape
+                          for c in [(x, y-1), (x, y+1), (x-1, y), (x+1, y)] if c not in shape])
+            shapes = set([tuple(sorted([(x - min([c[0] for c in shape]), y - min([c[1] for c in shape]))
+                                        for x, y in shape])) for shape in shapes])
+        for dim in dims:
+            found = set()
+            for shape in shapes:
+                cells = list(shape)
+                if max([max(c) for c in cells]) >= dim:
+                    continue            # not on the board
+                pattern = cache.arrange(cells)[0]
+                if pattern in found:
+                    continue
+                found.add(pattern)
+                if size == 1:
+                    values = [(NONE, n) for n in range(1, dim+1)]
+                else:
+                    products = set([1])
+                    for cell in cells:
+                        products = set([p * n for p in products for n in range(1, dim+1)])
+                    values = [(ADD, v) for v in range(size, size*dim + 1)] + \
+                             [(MUL, v) for v in sorted(products)]
+                if size == 2:
+                    values += [(SUB, v) for v in range(1, dim)] + [(DIV, v) for v in range(2, dim+1)]
+                for op, value in values:
+                    try:
+                        cage = Cage(op, str(value), cells, dim)
+                    except CageError:
+                        continue
+                    tiled = TiledCage(cage, dim, 0, lazy = True)
+                    key, order = cache.canonical(cage, dim)
+                    tiles = [tuple([tile[k] for k in order])
+                             for digits in tiled.multisets for tile in tiled.placements(digits)]
+                    if tiles:
+                        entries[cache.label(key)] = tiles
+    tileTable.write(path, entries)
+    return len(entries)
+
 class Board(Canvas):
     # View
 
@@ -460,11 +947,10 @@ class Board(Canvas):
         cw = self.cellWidth
         ch2 = ch // 2
         cw2 = cw // 2
-        for tile in solution:
-            for cell in [tile[n:n+3] for n in range(0,len(tile), 3)]:
-                x = x0 + int(cell[1]) * cw + cw2
-                y = y0 + int(cell[2]) * ch  + ch2
-                self.create_text(x, y, text='%s' % cell[0], font = solutionFont, anchor = CENTER, tag='Solution')
+        for n, col, row in solution:
+            x = x0 + col * cw + cw2
+            y = y0 + row * ch  + ch2
+            self.create_text(x, y, text='%d' % n, font = solutionFont, anchor = CENTER, tag='Solution')
 
     def printBoard(self):
         fout = asksaveasfilename( filetypes=[('postscript files', '.ps')],
@@ -518,6 +1004,9 @@ class Control(Frame):
         self.OkayButton = Button(self, text = 'Okay', command = self.okayCage)
         self.OkayButton.pack(side = LEFT, expand = YES)
 
+        self.StopButton = Button(self, text = 'Stop', command = parent.stopSolve, state = 'disabled')
+        self.StopButton.pack(side = LEFT, expand = YES)
+
         self.entry.bind('<Key-Return>', self.okayCage)
         self.entry.bind('<Key-KP_Enter>', self.okayCage)
 
@@ -565,6 +1054,22 @@ class Control(Frame):
         self.OkayButton.configure(state = 'disabled')
         self.entry.configure(state = 'disabled')
 
+    def enable(self):
+        self.OkayButton.configure(state = 'normal')
+        self.entry.configure(state = 'normal')
+
+    def solving(self, busy):
+        # The Stop button is only active while the solver is running, and the board
+        # and the cage controls only while it is not, so no cage can change under it
+
+        self.StopButton.configure(state = busy and 'normal' or 'disabled')
+        if busy:
+            self.disable()
+            self.parent.board.freeze()
+        else:
+            self.enable()
+            self.parent.board.unfreeze()
+
     def keyOp(self, event):
         self.op.set(self.key2op[event.keysym])
 
@@ -581,20 +1086,26 @@ class Control(Frame):
 
 class KenKen(object):
     updates = 0                         # class variable
+    maxUpdates = 10 ** 8                # ask before solving puzzles estimated to need more
+    estimateRows = 2000                 # only estimate searches with more rows left than this
+    preprocessRows = 50000              # preprocess the plain encoding only up to this many rows
+    lazyCells = None                    # cages with at least this many cells are tiled lazily
+    minLazyCells = 5                    # the least lazyCells allowed; see tileCurrentCage
 
     class TileThread(threading.Thread):
 
         mutex = threading.Lock()        # class variable
 
-        def __init__(self, cage, dim, id, cageDict):
+        def __init__(self, cage, dim, id, cageDict, lazy = False):
             self.cage = cage
             self.dim = dim
             self.id = id
             self.cageDict = cageDict
+            self.lazy = lazy
             threading.Thread.__init__(self)
 
         def run(self):
-            cage = TiledCage(self.cage, self.dim, self.id)
+            cage = TiledCage(self.cage, self.dim, self.id, self.lazy)
             self.mutex.acquire()
             self.cageDict[self.id] = cage
             self.mutex.release()
@@ -617,6 +1128,10 @@ class KenKen(object):
         self.threads = []             # list threads so we can wait for them to exit
         self.tiledCages = {}          # associate tiled cage with ID
         self.fileSaveDir = '.'        # directory for saving puzzles
+        self.stopToken = None         # set to stop the solver thread
+        self.solver = None            # the solver thread, while it runs
+        self.DLX = None               # the last exact cover solver
+        self.colored = False          # was the colored encoding used?
 
     def setTitle(self):
         N = self.dim
@@ -651,8 +1166,16 @@ class KenKen(object):
         return cage
 
     def tileCurrentCage(self, cage):
+        # Until a lazy cage is expanded, the search can't branch on the latin columns
+        # of the rows and columns of its cells (see Dancer._bestLazyColumn).  With
+        # smaller cages lazy, that is nearly all of them, and the search is hundreds
+        # of times longer on some puzzles, so lazyCells below minLazyCells is refused.
+
+        if self.lazyCells is not None and self.lazyCells < self.minLazyCells:
+            raise ValueError("lazyCells must be at least %d" % self.minLazyCells)
         ID = self.nextCage
-        thrd = self.TileThread(cage, self.dim, ID, self.tiledCages)
+        lazy = self.lazyCells is not None and len(cage) >= self.lazyCells
+        thrd = self.TileThread(cage, self.dim, ID, self.tiledCages, lazy)
         self.threads.append(thrd)
         for cell in cage:
             self.cageID[cell] = ID
@@ -667,22 +1190,17 @@ class KenKen(object):
             self.dumpLog()
 
             if askokcancel("All Cells Filled", "Ready to Solve?", parent = self.board):
-                start = time.clock()
-                cursor = self.board.cget('cursor')
-                self.board.configure(cursor = 'watch')
-                self.board.update()
                 self.solve()
-                self.board.configure(cursor = cursor)
-                elapsed = time.clock() - start
-                self.log.text.insert(INSERT, "%d updates %.1f seconds\n\n" % (self.updates, elapsed))
-                self.updates = 0
-                self.report()
 
-    def solve(self):
-        # Prepare input for dancing links solver and call solver
+    def solve(self, engine = 'dlx', colored = True):
+        # Prepare input for dancing links solver and start solver.
+        # engine is a key of engines, so the engines can be compared on the same puzzle.
+        # If colored, the puzzle is given to the Dancer in the colored encoding of
+        # TiledCage.encodeLinked, which has fewer rows; the other engines don't take it.
+        # The solver runs in its own thread, so that the Stop button works while it runs;
+        # pollSolver reports the result when it is done.  See search.
 
-        digits=   [str(x) for x in range(1, self.dim+1)]
-        lines =   [str(x) for x in range(self.dim)]
+        self.cancelSolver()
         idents =  set(self.cageID.values())
         self.solns = []
 
@@ -692,20 +1210,166 @@ class KenKen(object):
         cages = self.tiledCages
         temp = [(idx, cages[idx]) for idx in cages if idx in idents]
         cages = self.tiledCages = dict(temp)
-        primary = ['C'+ str(c) for c in idents] + [n+'R'+x for n in digits for x in lines] +\
-                      [n+'C'+x for n in digits for x in  lines]
-        primary.sort()
-        matrix = [tile for cage in cages.values() for tile in cage.code ]
+        # Lazy cages have their rows made during the search, which only Dancer does,
+        # and not in the colored encoding.
+
+        lazy = dict([(Layout.get(self.dim).cage(idx), cages[idx].lazyColumn())
+                     for idx in cages if cages[idx].lazy])
+        if lazy:
+            engine = 'dlx'
+        self.colored = colored = colored and engines[engine] is Dancer and not lazy
+        layout = Layout.get(self.dim, colored)
+        primary = layout.primary(idents)
+        secondary = layout.secondary(cages)
+        if colored:
+            matrix = [row for cage in cages.values() for row in cage.encodeLinked()]
+        else:
+            matrix = [tile for cage in cages.values() for tile in cage.code ]
 
-        DLX = Dancer(primary, matrix, pattern = re.compile(r'C\d+$'))
-        self.updates = DLX.solve()
-        self.solns = DLX.report()
+        # The last Dancer can be reused if the columns are the same
+
+        DLX = self.DLX
+        if isinstance(DLX, engines[engine]) and hasattr(DLX, 'reset') and DLX.primary == primary \
+           and DLX.secondary == secondary and not lazy and not DLX.lazy:
+            DLX.reset(matrix)
+        elif lazy:
+            DLX = Dancer(primary, matrix, secondary, bound = 'auto', pattern = layout, lazy = lazy)
+        else:
+            DLX = engines[engine](primary, matrix, secondary, bound = 'auto', pattern = layout)
+
+        # Preprocessing pays on the colored encoding, and on plain ones up to about
+        # preprocessRows rows; on 24Dec9, with 75690, it costs 7.7s against 5.8s without.
+
+        if hasattr(DLX, 'preprocess'):
+            DLX.usePreprocess = colored or len(matrix) <= self.preprocessRows
+
+        self.start = time.clock()
+        self.cursor = self.board.cget('cursor')
+        self.board.configure(cursor = 'watch')
+        self.control.solving(True)
+        self.DLX = DLX
+        self.solveArgs = kwargs = {}
+        if hasattr(DLX, 'setLimits'):               # engine can be stopped
+            self.stopToken = kwargs['cancel'] = CancelToken()
+        self.guess = None
+        self.tooBig = False
+        self.solver = threading.Thread(target = self.search, args = (DLX, kwargs))
+        self.solver.start()
+        self.win.after(100, self.pollSolver, self.solver)
+
+    def search(self, DLX, kwargs, estimate = True):
+        # The solver thread.  The matrix is reduced first, and then, if many rows are
+        # left, the search is estimated, so the user can be asked before a very long
+        # one.  A sample of the estimate can cost a good part of the search, so only a
+        # few are taken, within a budget of updates, and the Stop button stops them.
+        # If the estimate is over maxUpdates, the thread ends without solving, and
+        # pollSolver asks the user, on the main thread, whether to go on.
+
+        cancel = kwargs.get('cancel')
+        if estimate and hasattr(DLX, 'prepare'):
+            DLX.prepare(cancel)
+            if len(DLX.rows) - len(DLX.deleted) > self.estimateRows and \
+               not (cancel is not None and cancel.isSet()):
+                self.guess = DLX.estimate(samples = 10, max_updates = 10 ** 6, cancel = cancel)
+                if self.guess.updates > self.maxUpdates:
+                    self.tooBig = True
+                    return
+        DLX.solve(**kwargs)
+
+    def pollSolver(self, solver):
+        # Wait for the solver thread without blocking the event loop.  If the solver
+        # has been cancelled, it is no longer self.solver, and there is nothing to do.
+
+        if solver is not self.solver:
+            return
+        if solver.isAlive():
+            self.win.after(100, self.pollSolver, solver)
+            return
+        guess = self.guess
+        if guess is not None:
+            self.guess = None
+            self.log.text.insert(INSERT, "Estimated %d updates (+/- %d)\n" % (guess.updates, guess.updatesError))
+        if self.tooBig:
+            self.tooBig = False
+            if not self.stopToken.isSet() and \
+               askokcancel("Large Puzzle", "About %d updates needed.  Solve anyway?" % guess.updates,
+                           parent = self.board):
+                self.solver = threading.Thread(target = self.search, args = (self.DLX, self.solveArgs, False))
+                self.solver.start()
+                self.win.after(100, self.pollSolver, self.solver)
+                return
+            self.solverDone()
+            self.log.text.insert(INSERT, "Not solved\n\n")
+            return
+        self.solverDone()
+        elapsed = time.clock() - self.start
+        DLX = self.DLX
+        self.updates = DLX.updates
+        self.solns = [self.cells(soln) for soln in DLX.report()]
+        reduction = getattr(DLX, 'reduction', None)
+        if reduction is not None:
+            self.log.text.insert(INSERT, "Preprocessing: %d forced, %d of %d rows deleted, %d nodes, %d passes\n" %
+                                 (reduction.forced, reduction.rows, len(DLX.rows), reduction.nodes,
+                                  reduction.passes))
+        plan = getattr(DLX, 'plan', None)
+        if plan is not None:
+            layout = Layout.get(self.dim)
+            self.log.text.insert(INSERT, "IDLX plan: %s, bound %d, columns %s, %d of %d nodes\n" %
+                                 (plan.prefilter and 'prefilter' or 'no prefilter', plan.bound,
+                                  ' '.join([layout.name(col) for col in plan.columns]),
+                                  plan.excluded, plan.nodes))
+            for r in DLX.rounds:
+                self.log.text.insert(INSERT, "IDLX round %d: %d rows deleted, %d updates\n" %
+                                     (r.round, r.rows, r.updates))
+        self.log.text.insert(INSERT, "%d updates %.1f seconds\n\n" % (self.updates, elapsed))
+        self.updates = 0
+        result = getattr(DLX, 'result', None)
+        complete = result is None or result.complete
+        if not complete:
+            self.log.text.insert(INSERT, "Stopped after %d nodes: %d solutions found\n\n" %
+                                 (result.nodes, len(self.solns)))
+        self.report(complete)
+
+    def cells(self, soln):
+        # A solution from the solver, a list of (cage id, tiling number), as a list
+        # of (n, x, y) for each cell: digit n goes in cell (x, y).  In the colored
+        # encoding the rows are named by their cells already.
+
+        if self.colored:
+            return [cell for cells in soln for cell in cells]
+        return [cell for id, k in soln for cell in self.tiledCages[id].cells(k)]
+
+    def solverDone(self):
+        self.board.configure(cursor = self.cursor)
+        self.control.solving(False)
+        self.stopToken = None
+        self.solver = None
+
+    def stopSolve(self):
+        if self.stopToken is not None:
+            self.stopToken.set()
+
+    def cancelSolver(self):
+        # Stop the solver thread, if it is running, without reporting its result.  It
+        # only stops at its next check, so its Dancer is dropped rather than waited
+        # for: solve must not reset a Dancer that is still being searched.
+
+        if self.solver is None:
+            return
+        self.stopSolve()
+        self.DLX = None
+        self.solverDone()
+
+    def report(self, complete = True):
+        # If the search was stopped, there may be other solutions
 
-    def report(self):
         solns = self.solns
         if not solns:
-            showerror('Bad Problem', 'No Solution')
-        elif len(solns) == 1:
+            if complete:
+                showerror('Bad Problem', 'No Solution')
+            else:
+                showinfo('Stopped', 'No solution found')
+        elif len(solns) == 1 and complete:
             self.menu.file.entryconfigure('Save', state='normal')
             if askyesno('One Solution', 'Display the solution?', default='no'):
                 self.board.printSolution(solns[0])
@@ -726,6 +1390,7 @@ class KenKen(object):
         return answer
 
     def clear(self, dim):
+        self.cancelSolver()
         for thread in self.threads:         # make sure all threads have finished
             thread.join()
         self.cageID = {}
@@ -805,7 +1470,16 @@ class KenKen(object):
         idents =  set(self.cageID.values())
         for idx in idents:
             cage = self.tiledCages[idx]
-            self.log.text.insert(INSERT, 'Cage %d: length %d: %s\n' %(idx, len(cage.code), cage.cage))
+            if cage.lazy:
+                self.log.text.insert(INSERT, 'Cage %d: tiled during the search (%d multisets): %s\n'
+                                     %(idx, len(cage.multisets), cage.cage))
+            else:
+                self.log.text.insert(INSERT, 'Cage %d: length %d (%d multisets): %s\n'
+                                     %(idx, len(cage.code), len(cage.multisets), cage.cage))
+        cache = TiledCage.cache
+        self.log.text.insert(INSERT, 'Tiling cache: %d hits, %d misses\n' %(cache.hits, cache.misses))
+        if TiledCage.table is not None:
+            self.log.text.insert(INSERT, 'Tile table: %d hits\n' % TiledCage.table.hits)
 
     def savePuzzle(self):
         # Menu item is enabled if and only if the puzzle has been solved
@@ -828,8 +1502,7 @@ class KenKen(object):
             fout.write(cage.__str__())
             fout.write(' %s\n' % cage.color)
         fout.write('#\nSolution\n')
-        c = [tile[n:n+3] for tile in self.solns[0] for n in range(0, len(tile),3)]
-        c = tuple([x[0] for x in sorted(c, key = lambda y: y[2] + y[1] )])
+        c = tuple(['%d' % n for n, x, y in sorted(self.solns[0], key = lambda cell: (cell[2], cell[1]))])
         fmt = dim* '%s ' + '\n'
         for row in range(dim):
             fout.write( fmt % c[row*dim: (row+1)*dim] )
@@ -888,6 +1561,15 @@ class KenKen(object):
         cages[idx].color = min([x for x in range(6) if x not in nbdColors])
 
 def main():
+    # kenSolver.pyw --build-tiles [cells] builds the tile table, for cages of up to
+    # cells cells (5 if not given), instead of starting the solver
+
+    if sys.argv[1:2] == ['--build-tiles']:
+        maxCells = int((sys.argv[2:3] or ['5'])[0])
+        start = time.time()
+        count = buildTileTable(tilePath, maxCells)
+        print 'Wrote the tilings of %d cages to %s in %.1f seconds' % (count, tilePath, time.time() - start)
+        return
     root = Tk()
     KenKen(root, dim=9)
     root.mainloop()
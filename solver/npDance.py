@@ -0,0 +1,105 @@
+"""This script implements Knuth's Algorithm X for the exact cover problem, with the
+matrix held as a packed NumPy bit matrix, so that each step of the search is a
+handful of vectorized operations."""
+
+# Row k of the matrix is bit k of each column's bit string, and the bit strings are
+# packed eight rows to a byte: colBits[c] is the uint8 array for column c.  The state
+# of the search is a packed mask of the rows that can still be chosen, and a boolean
+# array of the primary columns still to be covered.  At each level
+#   - the length of every uncovered column is the popcount of colBits & mask,
+#     computed for all of them at once with a byte lookup table,
+#   - the column to branch on is the first argmin of those lengths,
+#   - choosing row r clears from the mask, in one operation, the OR of the bit
+#     strings of r's columns.
+# These replace the scan of the header list for the shortest column and the
+# node-by-node unlinking of dancing links.
+
+# The input and the interface are the same as for bitDance.BitDancer, and the columns
+# are chosen the same way, so all the engines search the same tree.  NumPy is only
+# needed if this engine is used.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from bitDance import BitDancer
+
+class NumpyDancer(BitDancer):
+
+    def __init__(self, primary, matrix, secondary = [], bound = 42000, pattern = None):
+        if numpy is None:
+            raise RuntimeError("NumpyDancer requires numpy")
+        self.nPrimary = len(primary)
+        BitDancer.__init__(self, primary, matrix, secondary, bound, pattern)
+
+    def readRows(self, matrix):
+        """Initialize the membership matrix.
+
+        The input is the same as for Dancer.readRows: each row lists the names of the
+        columns with a 1 in this row, followed by a symbolic name for the row."""
+
+        index = self.index
+        nPrimary = self.nPrimary
+        self.rows = [row[-1] for row in matrix]
+        dense = numpy.zeros((len(self.columns), len(matrix)), dtype = numpy.bool_)
+        self.rowCols = []           # the columns of each row
+        self.rowPrimary = []        # the primary columns of each row
+        for rowNum, row in enumerate(matrix):
+            cols = numpy.array([index[col] for col in row[:-1]], dtype = numpy.intp)
+            dense[cols, rowNum] = True
+            self.rowCols.append(cols)
+            self.rowPrimary.append(cols[cols < nPrimary])
+        self.colBits = numpy.packbits(dense, axis = 1)
+        self.activeRows = numpy.packbits(numpy.ones(len(matrix), dtype = numpy.bool_))
+        self.popCount = numpy.array([bin(b).count('1') for b in range(256)], dtype = numpy.intp)
+
+    def _dance(self, findAll):
+        # The main routine, a generator which yields the list of row numbers of each
+        # solution as it is found.  The list is only valid until the generator is resumed.
+
+        colBits    = self.colBits
+        rowCols    = self.rowCols
+        rowPrimary = self.rowPrimary
+        popCount   = self.popCount
+        nRows      = len(self.rows)
+        unpack     = numpy.unpackbits
+        choice     = []             # the rows in the current partial solution
+        stack      = []             # for each level: [rows, cols, candidates, next candidate]
+        rows       = self.activeRows
+        cols       = numpy.ones(self.nPrimary, dtype = numpy.bool_)
+
+        while True:
+
+            # forward: push the rows of the best column for branching
+
+            uncovered = numpy.flatnonzero(cols)
+            if len(uncovered) == 0:
+                yield choice
+                if not findAll:
+                    return
+            else:
+                lengths = popCount[colBits[uncovered] & rows].sum(axis = 1)
+                best = uncovered[lengths.argmin()]
+                candidates = numpy.flatnonzero(unpack(colBits[best] & rows)[:nRows])
+                stack.append([rows, cols, candidates, 0])
+                choice.append(None)
+
+            # advance: choose the next untried row, backing up as needed
+
+            while stack:
+                top = stack[-1]
+                if top[3] < len(top[2]):
+                    r = top[2][top[3]]
+                    top[3] += 1
+                    blocked = numpy.bitwise_or.reduce(colBits[rowCols[r]], axis = 0) & top[0]
+                    self.updates += int(popCount[blocked].sum())
+                    rows = top[0] ^ blocked
+                    cols = top[1].copy()
+                    cols[rowPrimary[r]] = False
+                    choice[-1] = int(r)
+                    break
+                stack.pop()
+                choice.pop()
+            else:
+                return                      # done
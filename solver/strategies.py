@@ -0,0 +1,224 @@
+"""Strategies for choosing the column to branch on in dance4.Dancer."""
+
+# Dancer always branches on the first shortest column in the header list, Knuth's
+# minimum remaining values rule.  In kenken matrices there are many ties, between the
+# nRy and nCx columns of the latin square and the short cage columns Cc, and which of
+# them is chosen can change the size of the search a good deal.  A strategy is an
+# object with a method choose(dancer) that returns the primary column to branch on,
+# or None if every primary column is covered.  Pass one to Dancer, or its name in
+# byName, as the strategy argument.
+
+# A column of length 0 or 1 is always chosen first, whatever the strategy: the first
+# is a dead end and the second a forced move, so nothing can do better.
+
+# compare() solves a set of problems with each strategy and reports the nodes and
+# updates of each, so that the best strategy for a corpus can be picked.
+
+import copy, random, re, time
+
+class Strategy(object):
+    # The base class.  choose() finds the shortest columns, and breakTie picks one of
+    # them.  The default is the first, as Dancer does without a strategy.
+
+    def choose(self, dancer):
+        ties = dancer.shortestColumns()
+        if len(ties) < 2:
+            return ties[0] if ties else None  # column 0 is a column too
+        if dancer.headers[ties[0]].length <= 1:
+            return ties[0]
+        return self.breakTie(dancer, ties)
+
+    def breakTie(self, dancer, ties):
+        return ties[0]
+
+class FirstShortest(Strategy):
+    # The minimum remaining values rule: the first shortest column.
+    pass
+
+class PreferCages(Strategy):
+    # Among the shortest columns, the first whose name matches pattern, by default the
+    # pattern given to the Dancer for the iterated dancing links pre-pass, which in
+    # kenSolver is the pattern of the cage columns.  As for the Dancer, pattern may be
+    # a list of patterns, and then a column matches if it matches any of them.
+
+    def __init__(self, pattern = None):
+        self.pattern = pattern
+
+    def breakTie(self, dancer, ties):
+        patterns = self.pattern or dancer.pattern
+        if patterns is None:
+            return ties[0]
+        if not isinstance(patterns, (list, tuple)):
+            patterns = [patterns]
+        for col in ties:
+            for pattern in patterns:
+                if pattern.match(col):
+                    return col
+        return ties[0]
+
+class RowLength(Strategy):
+    # Among the shortest columns, the one whose rows have the fewest 1s in all, since
+    # every 1 in a chosen row means another column to cover.
+
+    def breakTie(self, dancer, ties):
+        nodes  = dancer.nodes
+        matrix = dancer.matrix
+        best = None
+        minTotal = 10000000  # infinity
+        for col in ties:
+            total = 0
+            rr = nodes['head', col].down
+            while rr != 'head':
+                total += len(matrix[rr]) - 1
+                rr = nodes[rr, col].down
+            if total < minTotal:
+                best     = col
+                minTotal = total
+        return best
+
+class RandomTies(Strategy):
+    # A random one of the shortest columns.  With a seed, the choices, and so the
+    # search, are the same from run to run.
+
+    def __init__(self, seed = None):
+        self.seed = seed
+        self.rand = random.Random(seed)
+
+    def breakTie(self, dancer, ties):
+        return self.rand.choice(ties)
+
+def columnClass(col):
+    # The kind of column: its name with the digits left out, and n in front if it
+    # starts with one.  So 3R5 is 'nR', 3C2 is 'nC' and the cage column C14 is 'C'.
+    # Columns that are not strings are classed by str(col), which puts every integer
+    # column in class 'n'.  The numbered columns of kenSolver are classed instead by
+    # the classify method of its Layout, which Weighted uses when it is the pattern.
+
+    col = str(col)
+    kind = re.sub(r'\d+', '', col)
+    if col[:1].isdigit():
+        kind = 'n' + kind
+    return kind
+
+def classifier(pattern):
+    # The function that classes the columns of a Dancer with this pattern: the
+    # pattern's classify method if it has one, as kenSolver's Layout does, and
+    # otherwise columnClass.
+
+    return getattr(pattern, 'classify', columnClass)
+
+class Weighted(Strategy):
+    # The column with the smallest length * weight, where the weight depends on the
+    # class of the column, as found by classify, and is 1 for classes not in weights.
+    # Ties go to the first.  The weights can be learned from a corpus by learnWeights.
+    # By default the columns are classed by classifier(dancer.pattern).
+
+    def __init__(self, weights = {}, classify = None):
+        self.weights  = dict(weights)
+        self.classify = classify
+        self.dancer   = None        # the Dancer the costs are for
+        self.cost     = {}          # the weight of each column, as it is looked up
+
+    def choose(self, dancer):
+        headers = dancer.headers
+        if dancer is not self.dancer:
+            # the same column may be of another class in another problem
+            self.dancer = dancer
+            self.cost = {}
+            self.classifyColumn = self.classify or classifier(dancer.pattern)
+        cost    = self.cost
+        best = None
+        forced = None               # the first column of length 1
+        minScore = 10000000  # infinity
+        cur = headers['root'].next
+        while cur != 'root':
+            h = headers[cur]
+            if h.length == 0:
+                return cur          # a dead end: can't do better
+            if h.length == 1:
+                if forced is None:
+                    forced = cur
+                cur = h.next
+                continue
+            if cur not in cost:
+                cost[cur] = self.weights.get(self.classifyColumn(cur), 1.0)
+            score = h.length * cost[cur]
+            if score < minScore:
+                best     = cur
+                minScore = score
+            cur = h.next
+        if forced is not None:
+            return forced
+        return best
+
+byName = {'first':     FirstShortest,
+          'cage':      PreferCages,
+          'rowlength': RowLength,
+          'random':    RandomTies,
+          'weighted':  Weighted}
+
+def compare(problems, strategies = None, **kwargs):
+    """Solve each problem with each strategy, and return a dict giving, for each
+    strategy, the total (nodes, updates, seconds) over all the problems.  problems is a
+    list of (primary, matrix) pairs.  strategies is a dict of strategies, or of
+    functions that make them, by name; by default one of each kind in byName.  Each
+    problem gets a new strategy, made by the function or copied from the strategy,
+    so that nothing one problem leaves in it changes the next.  Other keyword
+    arguments are passed to Dancer."""
+
+    from dance4 import Dancer
+
+    if strategies is None:
+        strategies = byName
+    results = {}
+    for name, strategy in strategies.items():
+        nodes = updates = 0
+        start = time.clock()
+        for primary, matrix in problems:
+            if isinstance(strategy, Strategy):
+                fresh = copy.deepcopy(strategy)
+            else:
+                fresh = strategy()
+            dlx = Dancer(primary, matrix, strategy = fresh, **kwargs)
+            dlx.solve()
+            nodes   += dlx.nodeCount
+            updates += dlx.updates
+        results[name] = (nodes, updates, time.clock() - start)
+    return results
+
+def printComparison(results):
+    print "%-12s %12s %14s %9s" % ('strategy', 'nodes', 'updates', 'seconds')
+    for name in sorted(results, key = lambda name: results[name][1]):
+        nodes, updates, seconds = results[name]
+        print "%-12s %12d %14d %9.2f" % (name, nodes, updates, seconds)
+
+def learnWeights(problems, factors = (0.5, 0.8, 1.25, 2.0), rounds = 2, classify = None,
+                 **kwargs):
+    """Learn the weights of a Weighted strategy from a list of (primary, matrix)
+    problems, by coordinate descent: each round tries multiplying the weight of each
+    column class by each factor, and keeps the change if it lowers the total number
+    of updates.  The columns are classed by classify, by default as Weighted classes
+    them for the pattern in kwargs.  Returns the weights, for Weighted(weights)."""
+
+    classify = classify or classifier(kwargs.get('pattern'))
+    classes = set()
+    for primary, matrix in problems:
+        classes.update([classify(col) for col in primary])
+    weights = dict.fromkeys(classes, 1.0)
+
+    def cost(weights):
+        return compare(problems, {'w': Weighted(weights, classify)}, **kwargs)['w'][1]
+
+    best = cost(weights)
+    for round in range(rounds):
+        changed = False
+        for kind in sorted(classes):
+            for factor in factors:
+                trial = dict(weights)
+                trial[kind] *= factor
+                updates = cost(trial)
+                if updates < best:
+                    best, weights, changed = updates, trial, True
+        if not changed:
+            break
+    return weights
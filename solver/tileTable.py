@@ -0,0 +1,96 @@
+"""A table of precomputed tilings in a binary file, read through mmap, so that every
+process that opens it shares the same pages of the file cache."""
+
+# The table maps keys, which are strings, to lists of tilings, which are tuples of
+# digits of the same length.  The file is
+#   - a header: the magic string, the number of keys, and the offset of the keys,
+#   - an index: for each key, in sorted order, the offset and length of the key, the
+#     length of its tilings, and the offset and number of the tilings,
+#   - the keys, one after the other, and
+#   - the tilings, one byte per digit.
+# lookup() does a binary search of the index, reading only the records and keys it
+# compares, and turns just the tilings it finds into tuples.  Nothing is read when
+# the table is opened but the header.
+
+# kenSolver builds the table of all the cages it can (see buildTileTable there), and
+# TiledCage looks up cages in it before tiling them.
+
+import mmap, os, struct
+
+MAGIC = 'KKT1'
+HEADER = struct.Struct('<4sII')         # magic, number of keys, offset of the keys
+RECORD = struct.Struct('<IHHII')        # key offset, key length, width, tiles offset, tiles
+
+class TileTable(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, self.count, self.keysOffset = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a tile table' % path)
+        self.hits = 0
+
+    def record(self, k):
+        return RECORD.unpack_from(self.map, HEADER.size + k * RECORD.size)
+
+    def key(self, k):
+        offset, length = self.record(k)[:2]
+        return self.map[offset:offset + length]
+
+    def lookup(self, key):
+        # The list of tilings for key, or None if it is not in the table
+
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count or self.key(low) != key:
+            return None
+        width, offset, count = self.record(low)[2:]
+        digits = iter(bytearray(self.map[offset:offset + width * count]))
+        self.hits += 1
+        return zip(*[digits] * width)   # the tilings, width digits at a time
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+def write(path, entries):
+    # Write the table of entries, a dict of lists of tilings by key.  The file is
+    # written beside path and then renamed, so a reader never sees half of it.
+
+    keys = sorted(entries)
+    keysOffset = HEADER.size + len(keys) * RECORD.size
+    dataOffset = keysOffset + sum([len(key) for key in keys])
+    index = []
+    keyOffset = keysOffset
+    for key in keys:
+        tiles = entries[key]
+        width = tiles and len(tiles[0]) or 0
+        index.append(RECORD.pack(keyOffset, len(key), width, dataOffset, len(tiles)))
+        keyOffset += len(key)
+        dataOffset += width * len(tiles)
+
+    temp = path + '.new'
+    out = open(temp, 'wb')
+    out.write(HEADER.pack(MAGIC, len(keys), keysOffset))
+    out.write(''.join(index))
+    out.write(''.join(keys))
+    for key in keys:
+        out.write(''.join([str(bytearray(tile)) for tile in entries[key]]))
+    out.close()
+    if os.path.exists(path):
+        os.remove(path)                 # Windows will not rename over a file
+    os.rename(temp, path)
+
+def load(path):
+    # The table in path, or None if there is none
+
+    if not os.path.exists(path):
+        return None
+    return TileTable(path)